@@ -1,6 +1,9 @@
-from .lottieparser import LottieParser, load_animation
+from .lottieparser import LottieParser, load_animations
+from .dotlottie import is_dotlottie
+from .encoding import print_report
 from .paintcompiler import compile_paints
 from .font import font_builder, add_glyphs
+from .timeline import DEFAULT_EPSILON
 from pathlib import Path
 import sys
 import argparse
@@ -10,41 +13,119 @@ parser.add_argument('--verbose', '-v', action='store_true',
                     help='display the generated paint description')
 parser.add_argument('--output', '-o', dest='output',
                     help='output TTF file')
-parser.add_argument('input', metavar='JSON',
-                    help='input lottie file')
+parser.add_argument('--epsilon', type=float, default=DEFAULT_EPSILON,
+                    help='snap keyframe times closer than this many frames together')
+parser.add_argument('--iup', type=float, dest='iup_tolerance', metavar='TOLERANCE',
+                    help='drop gvar deltas which can be interpolated within this tolerance')
+parser.add_argument('--jobs', '-j', type=int,
+                    help='number of worker processes (default: one per CPU)')
+parser.add_argument('--quantize', '-q', type=float, dest='grid', metavar='GRID',
+                    help='snap coordinates and transform values to a grid of this many units')
+parser.add_argument('--choose-encoding', action='store_true',
+                    help='store rigidly moving shapes as variable transforms where that is '
+                    'cheaper than gvar, and report the choice for each glyph')
+parser.add_argument('--clip-boxes', action='store_true',
+                    help='work out clip boxes for the COLR glyphs (slows the build down)')
+parser.add_argument('--shard', action='store_true',
+                    help='convert the top-level layers of each animation in parallel')
+parser.add_argument('--watch', '-w', action='store_true',
+                    help='rebuild the font whenever the input file changes')
+parser.add_argument('--codepoint', '-c', type=lambda x: int(x, 16), default=0x61,
+                    help='hex codepoint of the (first) animation (default: 61)')
+parser.add_argument('input', metavar='FILE', nargs='+',
+                    help='input Lottie JSON or dotLottie file(s); with --output, several '
+                    'animations are packed into one font')
 
 args = parser.parse_args()
 
+if args.watch:
+    if len(args.input) > 1:
+        parser.error("--watch only works with a single input file")
+    if is_dotlottie(args.input[0]):
+        parser.error("--watch only works with Lottie JSON files")
+    from .watch import watch
+    infile = Path(args.input[0])
+    watch(infile, args.output or infile.with_suffix(".ttf"), epsilon=args.epsilon,
+          iup_tolerance=args.iup_tolerance, jobs=args.jobs, grid=args.grid,
+          choose_encoding=args.choose_encoding, clip_boxes=args.clip_boxes)
+    sys.exit(0)
 
-infile = Path(args.input)
-if not args.output:
- args.output = infile.with_suffix(".ttf")
+# (input file, index, name, animation) for every animation in every input
+try:
+    animations = [
+        (Path(x), ix, name, an)
+        for x in args.input
+        for ix, (name, an) in enumerate(load_animations(x))
+    ]
+except ValueError as e:
+    parser.error(str(e))
 
-an = load_animation(infile)
+if len(animations) > 1 and args.output:
+    from .pack import pack_animations, base_glyph_names
+    names = base_glyph_names([name for _, _, name, _ in animations])
+    base_glyphs = {name: args.codepoint + ix for ix, name in enumerate(names)}
+    fontbuilder, python_description = pack_animations(
+        [an for _, _, _, an in animations], base_glyphs, epsilon=args.epsilon,
+        iup_tolerance=args.iup_tolerance, jobs=args.jobs, grid=args.grid,
+        choose_encoding=args.choose_encoding, clip_boxes=args.clip_boxes
+    )
+    if args.verbose:
+        print(python_description)
+    for name, codepoint in base_glyphs.items():
+        print(f"U+{codepoint:04X}: {name}")
+    print(f"Written on {args.output}")
+    fontbuilder.font.save(args.output)
+    sys.exit(0)
 
-paint_builder = LottieParser(an)
 
-# Create the paint description and the glyph descriptions
-paint_builder.process()
-python_description = 'glyphs["baseglyph"] = ' + paint_builder.paint
+def convert(infile, index, an, output):
+    if args.shard:
+        from .shard import convert_sharded
+        fontbuilder, python_description = convert_sharded(
+            infile, an, index, epsilon=args.epsilon, iup_tolerance=args.iup_tolerance,
+            jobs=args.jobs, grid=args.grid, codepoint=args.codepoint,
+            choose_encoding=args.choose_encoding, clip_boxes=args.clip_boxes
+        )
+        if args.verbose:
+            print(python_description)
+        print(f"Written on {output}")
+        fontbuilder.font.save(output)
+        return
 
-# Display the glyph description
-if args.verbose:
-    try:
-        from black import format_file_contents, Mode
-        python_description = format_file_contents(python_description, fast=True, mode=Mode(line_length=78))
-    except:
-        pass
+    paint_builder = LottieParser(an, epsilon=args.epsilon, grid=args.grid,
+                                 choose_encoding=args.choose_encoding)
 
-    print(python_description)
+    # Create the paint description and the glyph descriptions
+    paint_builder.process()
+    python_description = 'glyphs["baseglyph"] = ' + paint_builder.paint
 
-# Add the glyph descriptions to the font
-fontbuilder = font_builder(an)
-add_glyphs(fontbuilder, paint_builder.glyphs)
+    # Display the glyph description
+    if args.verbose:
+        try:
+            from black import format_file_contents, Mode
+            python_description = format_file_contents(python_description, fast=True, mode=Mode(line_length=78))
+        except:
+            pass
 
-# Compile COLR/CPAL tables
-compile_paints(fontbuilder.font, python_description)
+        print(python_description)
 
-print(f"Written on {args.output}")
-fontbuilder.font.save(args.output)
+    # Add the glyph descriptions to the font
+    fontbuilder = font_builder(an)
+    add_glyphs(fontbuilder, paint_builder.glyphs, iup_tolerance=args.iup_tolerance, jobs=args.jobs,
+               base_glyphs={"baseglyph": args.codepoint}, quantizer=paint_builder.quantizer)
 
+    # Compile COLR/CPAL tables
+    compile_paints(fontbuilder.font, python_description, clips=args.clip_boxes)
+
+    if args.grid:
+        print(f"Quantized to a {args.grid} unit grid; maximum error {paint_builder.quantizer.max_error:.3f} units")
+    if paint_builder.encodings:
+        print_report(paint_builder.encodings.choices)
+
+    print(f"Written on {output}")
+    fontbuilder.font.save(output)
+
+
+# Without --output, each animation gets its own font next to its input file
+for infile, index, name, an in animations:
+    convert(infile, index, an, args.output or infile.with_name(name + ".ttf"))
@@ -0,0 +1,430 @@
+import argparse
+import copy
+import math
+import numpy as np
+from fontTools.misc.transform import Identity
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables import otTables as ot
+from fontTools.ttLib.tables.otConverters import BaseFixedValue
+from fontTools.varLib.iup import iup_delta
+from fontTools.varLib.varStore import VarStoreInstancer
+
+
+__all__ = ["keyframe_locations", "animated_bounds", "clip_boxes"]
+
+# Each stretch between keyframes is measured in this many pieces. The
+# bounds are conservative however many there are, but cover a stretch more
+# tightly the shorter its pieces.
+SUBDIVISIONS = 2
+
+# A rotation's sweep is followed in steps of at most this many degrees
+ROTATION_STEP = 5
+
+# Point clouds with more points than this are replaced by a polygon around
+# them with this many sides, keeping nested sweeps from multiplying them.
+MAX_POINTS = 64
+
+# Renderers round the interpolated values, so boxes get this many units
+# of slack on every side.
+MARGIN = 1
+
+# A clip box is made variable when the box around the whole animation is
+# this much larger than the boxes around its keyframes, on average.
+VARIABLE_CLIP_RATIO = 1.5
+
+
+def keyframe_locations(font, colr):
+    """The normalized ANIM locations at which anything in the font changes
+    direction: the peaks and ends of every gvar tuple and VarStore region,
+    plus the ends of the axis."""
+    locations = {0.0, 1.0}
+    if "gvar" in font:
+        for variations in font["gvar"].variations.values():
+            for variation in variations:
+                locations.update(variation.axes["ANIM"])
+    if colr.VarStore is not None:
+        for region in colr.VarStore.VarRegionList.Region:
+            axis = region.VarRegionAxis[0]
+            locations.update((axis.StartCoord, axis.PeakCoord, axis.EndCoord))
+    return sorted(x for x in locations if 0 <= x <= 1)
+
+
+def _samples(locations, subdivisions):
+    samples = [locations[0]]
+    for start, end in zip(locations, locations[1:]):
+        samples.extend(np.linspace(start, end, subdivisions + 1)[1:].tolist())
+    return samples
+
+
+def _scalars(locations, axes):
+    # varLib.models.supportScalar for one axis, at many locations at once
+    start, peak, end = axes["ANIM"]
+    if peak == 0:
+        return np.ones_like(locations)
+    rising = (locations - start) / (peak - start) if peak != start else 1
+    falling = (end - locations) / (end - peak) if end != peak else 1
+    scalars = np.where(locations < peak, rising, falling)
+    scalars = np.where((locations <= start) | (locations >= end), 0, scalars)
+    return np.where(locations == peak, 1, scalars)
+
+
+class _Outlines:
+    """The points of each glyph at every one of the `samples` locations.
+
+    Drawing every glyph through a glyph set at every location is slow, so
+    each animated glyph's gvar deltas are applied at all the samples in one
+    go instead. The points include off-curve points, so give control
+    bounds."""
+
+    def __init__(self, font, samples):
+        self.glyf = font["glyf"]
+        self.metrics = font["hmtx"].metrics
+        self.variations = font["gvar"].variations if "gvar" in font else {}
+        self.samples = np.asarray(samples, dtype=float)
+        self._points = {}
+
+    def _compute(self, glyphname):
+        coords, controls = self.glyf._getCoordinatesAndControls(glyphname, self.metrics)
+        base = np.array(coords, dtype=float).reshape(-1, 2)
+        variations = self.variations.get(glyphname)
+        if not variations:
+            return self._placed(base)
+        end_points = controls[1] if controls[0] >= 1 else list(range(len(controls[1])))
+        points = np.repeat(base[None], len(self.samples), axis=0)
+        for variation in variations:
+            delta = variation.coordinates
+            if None in delta:
+                delta = iup_delta(delta, coords, end_points)
+            delta = np.array(delta, dtype=float).reshape(-1, 2)
+            points += _scalars(self.samples, variation.axes)[:, None, None] * delta
+        return self._placed(points)
+
+    @staticmethod
+    def _placed(points):
+        # Like TrueType rasterizers, put the glyph's origin at the first
+        # phantom point, in case the lsb in hmtx is not the glyph's xMin.
+        origin = points[..., -4:-3, :] * (1, 0)
+        return points[..., :-4, :] - origin
+
+    def __call__(self, glyphname, ix):
+        if glyphname not in self._points:
+            self._points[glyphname] = self._compute(glyphname)
+        points = self._points[glyphname]
+        return points[ix] if points.ndim == 3 else points
+
+
+class _Instance:
+    """The glyph outlines and paint values of a font at one location (the
+    `ix`th of the `outlines`' samples)."""
+
+    def __init__(self, font, colr, outlines, ix):
+        self.colr = colr
+        self.outlines = outlines
+        self.ix = ix
+        location = outlines.samples[ix]
+        self.deltas = None
+        if colr.VarStore is not None:
+            self.deltas = VarStoreInstancer(colr.VarStore, font["fvar"].axes, {"ANIM": location})
+        self.mapping = colr.VarIndexMap.mapping if colr.VarIndexMap else []
+        self._static = {}
+
+    def points(self, glyphname):
+        return self.outlines(glyphname, self.ix)
+
+    def _instantiate(self, table):
+        for name in table.getVariableAttrs():
+            if table.VarIndexBase == ot.NO_VARIATION_INDEX or self.deltas is None:
+                continue
+            conv = table.getConverterByName(name)
+            index = table.VarIndexBase + conv.getVarIndexOffset()
+            if self.mapping:
+                index = self.mapping[min(index, len(self.mapping) - 1)]
+            delta = self.deltas[index]
+            value = getattr(table, name)
+            if isinstance(conv, BaseFixedValue):
+                value = conv.fromInt(conv.toInt(value) + delta)
+            else:
+                value += delta
+            setattr(table, name, value)
+
+    def static(self, paint):
+        """The paint, or a static copy of it with its variations applied."""
+        if not ot.PaintFormat(paint.Format).is_variable():
+            return paint
+        if id(paint) not in self._static:
+            static = copy.copy(paint)
+            self._instantiate(static)
+            if paint.Format == ot.PaintFormat.PaintVarTransform:
+                static.Transform = copy.copy(paint.Transform)
+                self._instantiate(static.Transform)
+            static.Format -= 1
+            self._static[id(paint)] = static
+        return self._static[id(paint)]
+
+
+def _transformed(points, transform):
+    xx, xy, yx, yy, dx, dy = transform
+    return points @ np.array([[xx, xy], [yx, yy]]) + (dx, dy)
+
+
+def _norm(transform):
+    # The most the transform stretches any vector: its largest singular value
+    xx, xy, yx, yy, _, _ = transform
+    half = (xx ** 2 + xy ** 2 + yx ** 2 + yy ** 2) / 2
+    det = xx * yy - xy * yx
+    return math.sqrt(half + math.sqrt(max(half ** 2 - det ** 2, 0)))
+
+
+# The directions of the sides of the polygon which replaces a large cloud,
+# and for each pair of neighbouring sides the inverse of the matrix whose
+# rows are their directions, which gives the vertex where they cross.
+_NORMALS = np.stack(
+    [
+        np.cos(np.linspace(0, 2 * np.pi, MAX_POINTS, endpoint=False)),
+        np.sin(np.linspace(0, 2 * np.pi, MAX_POINTS, endpoint=False)),
+    ],
+    axis=1,
+)
+_NEXT = np.roll(np.arange(MAX_POINTS), -1)
+_CORNERS = np.linalg.inv(np.stack([_NORMALS, _NORMALS[_NEXT]], axis=1))
+
+
+def _reduced(points):
+    if len(points) <= MAX_POINTS:
+        return points
+    # The polygon's sides touch the cloud, so it contains its convex hull
+    support = (points @ _NORMALS.T).max(axis=0)
+    return _CORNERS[:, :, 0] * support[:, None] + _CORNERS[:, :, 1] * support[_NEXT, None]
+
+
+def _apply(cloud, transforms):
+    """The cloud moved by a transform which varies linearly from one to
+    another of `transforms` over a stretch (or anywhere among them)."""
+    points, pad = cloud
+    transforms = list(dict.fromkeys(transforms))
+    if transforms == [Identity]:
+        return cloud
+    moved = np.concatenate([_transformed(points, t) for t in transforms])
+    if pad:
+        pad *= max(_norm(t) for t in transforms)
+    return _reduced(moved), pad
+
+
+def _rotated(cloud, start, end):
+    """The cloud swept about the origin from `start` to `end` degrees."""
+    points, pad = cloud
+    if start == end:
+        return _apply(cloud, [Identity.rotate(math.radians(start))])
+    steps = math.ceil(abs(end - start) / ROTATION_STEP)
+    angles = np.radians(np.linspace(start, end, steps + 1))
+    # A point's arc strays from the chords between the steps by at most
+    # its radius times 1 - cos(half a step)
+    radius = np.sqrt((points ** 2).sum(axis=1)).max()
+    sagitta = radius * (1 - math.cos((angles[1] - angles[0]) / 2))
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    x, y = points[:, 0], points[:, 1]
+    moved = np.stack([x * cos - y * sin, x * sin + y * cos], axis=2).reshape(-1, 2)
+    return _reduced(moved), pad + abs(sagitta)
+
+
+_TRANSFORMS = ("PaintTransform", "PaintTranslate", "PaintScale", "PaintRotate", "PaintSkew")
+
+
+class _Stretch:
+    """Everything drawn between two locations with no keyframe between them.
+
+    Between keyframes every variable value (gvar point, paint value) moves
+    linearly, so a point of a glyph stays on the segment between where it
+    is at either end, and a translation, scale or matrix stays between its
+    values at either end. `cloud` works out, for a paint, a set of points
+    and a padding distance such that everything the paint draws anywhere
+    in the stretch is inside the points' convex hull, grown by the padding.
+    Rotations are followed along their arc in small steps, and the padding
+    covers the bulge of the arc between them.
+
+    The clouds of paints which do not vary at all are kept in `fixed`,
+    which can be shared between stretches."""
+
+    def __init__(self, colr, start, end, fixed=None):
+        self.colr = colr
+        self.start = start
+        self.end = end
+        self.fixed = {} if fixed is None else fixed
+
+    def cloud(self, paint):
+        """A ``(points, padding)`` pair, or None if the paint draws no
+        outlines."""
+        return self._measure(paint)[0]
+
+    def _measure(self, paint):
+        # The paint's cloud, and whether it is the same in every stretch
+        if id(paint) in self.fixed:
+            return self.fixed[id(paint)], True
+        if paint.Format == ot.PaintFormat.PaintGlyph:
+            start = self.start.points(paint.Glyph)
+            end = self.end.points(paint.Glyph)
+            if end is start:
+                cloud = (start, 0) if len(start) else None
+            else:
+                cloud = _reduced(np.concatenate([start, end])), 0
+            fixed = end is start
+        else:
+            measured = [self._measure(child.value) for child in paint.iterPaintSubTables(self.colr)]
+            fixed = not ot.PaintFormat(paint.Format).is_variable() and all(f for _, f in measured)
+            clouds = [cloud for cloud, _ in measured if cloud is not None]
+            cloud = None
+            if clouds:
+                cloud = self.transformed(
+                    (
+                        _reduced(np.concatenate([points for points, _ in clouds])),
+                        max(pad for _, pad in clouds),
+                    ),
+                    paint,
+                )
+        if fixed:
+            self.fixed[id(paint)] = cloud
+        return cloud, fixed
+
+    def transformed(self, cloud, paint):
+        """The cloud moved by the paint's transform, if it has one."""
+        start = self.start.static(paint)
+        end = self.end.static(paint)
+        name = ot.PaintFormat(start.Format).name
+        if not name.startswith(_TRANSFORMS):
+            return cloud
+        centres = []
+        if name.endswith("AroundCenter"):
+            # Take the centre out, so the transform itself is about the origin
+            centres = [(p.centerX, p.centerY) for p in (start, end)]
+            cloud = _apply(cloud, [Identity.translate(-x, -y) for x, y in centres])
+            if not name.startswith("PaintRotate"):
+                start, end = copy.copy(start), copy.copy(end)
+                for p in (start, end):
+                    p.centerX = p.centerY = 0
+        if name.startswith("PaintRotate"):
+            cloud = _rotated(cloud, start.angle, end.angle)
+        elif name.startswith("PaintSkew"):
+            # The matrix does not move linearly with the skew angles, but
+            # stays among the matrices of their extremes
+            corners = []
+            for x in {start.xSkewAngle, end.xSkewAngle}:
+                for y in {start.ySkewAngle, end.ySkewAngle}:
+                    corners.append(Identity.skew(math.radians(-x), math.radians(y)))
+            cloud = _apply(cloud, corners)
+        else:
+            cloud = _apply(cloud, [start.getTransform(), end.getTransform()])
+        if centres:
+            cloud = _apply(cloud, [Identity.translate(x, y) for x, y in centres])
+        return cloud
+
+
+def animated_bounds(font, colr=None, subdivisions=SUBDIVISIONS):
+    """Measures every COLR base glyph across the animation.
+
+    Returns the keyframe locations (see `keyframe_locations`) and a
+    dictionary mapping each base glyph to an array with one ``xMin, yMin,
+    xMax, yMax`` row for each stretch between neighbouring locations (NaN
+    where the glyph draws nothing). Each box is guaranteed to contain the
+    control bounds of everything the glyph draws in its stretch, but may
+    be larger; with fewer `subdivisions` it is quicker to work out, but
+    looser.
+
+    `colr` is the COLR table (the ``.table`` of the font's by default)."""
+    if colr is None:
+        colr = font["COLR"].table
+    locations = keyframe_locations(font, colr)
+    samples = _samples(locations, subdivisions)
+    records = colr.BaseGlyphList.BaseGlyphPaintRecord if colr.BaseGlyphList else []
+    result = {record.BaseGlyph: np.full((len(locations) - 1, 4), np.nan) for record in records}
+    outlines = _Outlines(font, samples)
+    instances = [_Instance(font, colr, outlines, ix) for ix in range(len(samples))]
+    fixed = {}
+    for ix, (start, end) in enumerate(zip(instances, instances[1:])):
+        stretch = _Stretch(colr, start, end, fixed)
+        for record in records:
+            cloud = stretch.cloud(record.Paint)
+            if cloud is None:
+                continue
+            points, pad = cloud
+            box = np.concatenate([points.min(axis=0) - pad, points.max(axis=0) + pad])
+            boxes = result[record.BaseGlyph]
+            row = ix // subdivisions
+            if not np.isnan(boxes[row, 0]):
+                box = np.concatenate([np.minimum(boxes[row, :2], box[:2]), np.maximum(boxes[row, 2:], box[2:])])
+            boxes[row] = box
+    return locations, result
+
+
+def _union(boxes, margin=0):
+    return (
+        math.floor(np.nanmin(boxes[:, 0])) - margin,
+        math.floor(np.nanmin(boxes[:, 1])) - margin,
+        math.ceil(np.nanmax(boxes[:, 2])) + margin,
+        math.ceil(np.nanmax(boxes[:, 3])) + margin,
+    )
+
+
+def _area(box):
+    return max(box[2] - box[0], 0) * max(box[3] - box[1], 0)
+
+
+def clip_boxes(font, colr=None, subdivisions=SUBDIVISIONS, ratio=VARIABLE_CLIP_RATIO):
+    """Works out a clip box for each COLR base glyph which draws anything.
+
+    Glyphs whose extent stays much the same get a static box around the whole
+    animation, as a tuple of ``xMin, yMin, xMax, yMax``. The others get a list
+    of ``(location, box)`` masters, one per keyframe location, for a variable
+    box. Each master covers the stretches on either side of its keyframe, so
+    the box interpolated between two masters covers everything drawn in
+    between."""
+    locations, bounds = animated_bounds(font, colr, subdivisions)
+    result = {}
+    for glyphname, boxes in bounds.items():
+        if np.all(np.isnan(boxes)):
+            continue
+        union = _union(boxes, MARGIN)
+        masters = []
+        for ix, location in enumerate(locations):
+            around = boxes[max(ix - 1, 0) : ix + 1]
+            if np.all(np.isnan(around)):
+                # Nothing drawn nearby; keep the box empty but in place
+                around = np.array([[union[0], union[1], union[0], union[1]]])
+            masters.append((location, _union(around, MARGIN)))
+        average = np.mean([_area(box) for _, box in masters])
+        if len(masters) > 1 and _area(union) > ratio * average:
+            result[glyphname] = masters
+        else:
+            result[glyphname] = union
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="lottie2vf.bounds",
+        description="Report the animated bounds of the COLR glyphs in fonts",
+    )
+    parser.add_argument("--quick", action="store_true",
+                        help="measure each stretch between keyframes in one go (looser bounds)")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="show the bounds at each keyframe")
+    parser.add_argument("font", metavar="FONT", nargs="+")
+    args = parser.parse_args(args)
+
+    subdivisions = 1 if args.quick else SUBDIVISIONS
+    for path in args.font:
+        font = TTFont(path)
+        axis = font["fvar"].axes[0]
+        to_frame = lambda loc: axis.defaultValue + loc * (axis.maxValue - axis.defaultValue)
+        print(path)
+        for glyphname, box in clip_boxes(font, subdivisions=subdivisions).items():
+            if isinstance(box, tuple):
+                print(f"  {glyphname}: {box}")
+                continue
+            print(f"  {glyphname}: {_union(np.array([b for _, b in box]))}, variable")
+            if args.verbose:
+                for location, master in box:
+                    print(f"    frame {to_frame(location):g}: {master}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import json
+import logging
+import mmap
+import posixpath
+import zipfile
+from lottie import objects
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["DotLottie", "is_dotlottie"]
+
+# dotLottie v1 keeps animations in "animations/", v2 in "a/"
+ANIMATION_DIRS = ("animations", "a")
+
+
+class _Map(mmap.mmap):
+    # zipfile wants seekable(), which mmap only has from Python 3.13
+    def seekable(self):
+        return True
+
+
+def is_dotlottie(path):
+    """Whether `path` is a dotLottie archive rather than plain Lottie JSON."""
+    with open(path, "rb") as f:
+        return f.read(4) == b"PK\x03\x04"
+
+
+class DotLottie:
+    """A dotLottie (``.lottie``) archive.
+
+    The archive is memory-mapped and its members are decompressed straight
+    into the JSON parser, so nothing is extracted to disk. Use as a context
+    manager, or call `close` when done."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = _Map(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.zip = zipfile.ZipFile(self._map)
+        self.manifest = self._read_json("manifest.json") if self._has("manifest.json") else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+        self._map.close()
+        self._file.close()
+
+    def _has(self, name):
+        try:
+            self.zip.getinfo(name)
+            return True
+        except KeyError:
+            return False
+
+    def _read_json(self, name):
+        with self.zip.open(name) as f:
+            return json.load(f)
+
+    def _member(self, animation_id):
+        for directory in ANIMATION_DIRS:
+            name = posixpath.join(directory, animation_id + ".json")
+            if self._has(name):
+                return name
+        raise ValueError(f"{self.path}: no animation data for {animation_id!r}")
+
+    @property
+    def animation_ids(self):
+        """The ids of the animations in the archive, in manifest order.
+        Raises ValueError if there are none."""
+        if self.manifest.get("animations"):
+            ids = [entry["id"] for entry in self.manifest["animations"]]
+        else:
+            # No manifest: take whatever JSON is in the animation directories
+            ids = [
+                posixpath.splitext(posixpath.basename(name))[0]
+                for name in sorted(self.zip.namelist())
+                if posixpath.dirname(name) in ANIMATION_DIRS and name.endswith(".json")
+            ]
+        if not ids:
+            raise ValueError(f"{self.path}: no animations in the archive")
+        return ids
+
+    def load(self, animation_id):
+        return objects.Animation.load(self._read_json(self._member(animation_id)))
+
+    def animations(self):
+        """Returns a list of ``(id, Animation)`` pairs for the whole archive."""
+        result = [(ix, self.load(ix)) for ix in self.animation_ids]
+        logger.debug("%s: %i animation(s)", self.path, len(result))
+        return result
@@ -0,0 +1,166 @@
+import numpy as np
+from fontTools.misc.fixedTools import otRound
+from fontTools.ttLib.tables.TupleVariation import TupleVariation
+from fontTools.varLib.models import VariationModel
+
+from .font import _tuple_size
+from .transformation import values_to_ot
+
+__all__ = ["EncodingChooser", "print_report"]
+
+# How far (in font units) a keyframe outline may be from an affine image
+# of the first one and still count as a rigid motion.
+RIGID_TOLERANCE = 0.5
+
+# PaintVarTransform (7 bytes) + VarAffine2x3 (28 bytes) + six delta-set
+# index map entries
+VAR_TRANSFORM_BYTES = 35 + 6 * 4
+# 16.16 deltas need a 32-bit VarStore column per region
+FIXED_DELTA_BYTES = 4
+
+# Render cost is counted in values a renderer has to interpolate at each
+# frame; with one axis, at most two regions are active at once. It is
+# weighed against bytes of font data, and interpolating is cheap.
+RENDER_WEIGHT = 0.25
+ACTIVE_REGIONS = 2
+
+
+def _points(layer):
+    return [(node.x, node.y) for shape in layer.shapes for node in shape.nodes]
+
+
+def affine_fit(base, target):
+    """Finds the affine transform taking the `base` points onto `target`.
+
+    Returns the transform as ``(xx, xy, yx, yy, dx, dy)`` and the largest
+    distance between a transformed base point and its target."""
+    base = np.asarray(base, dtype=float)
+    target = np.asarray(target, dtype=float)
+    design = np.hstack([base, np.ones((len(base), 1))])
+    solution, *_ = np.linalg.lstsq(design, target, rcond=None)
+    error = np.max(np.hypot(*(design @ solution - target).T))
+    (xx, yx), (xy, yy), (dx, dy) = solution
+    return (xx, xy, yx, yy, dx, dy), error
+
+
+def gvar_bytes(layers, locations):
+    """Estimates the gvar data for outlines at normalized `locations`.
+
+    The estimate is made on the cubic outlines, before cu2qu."""
+    model = VariationModel([{"ANIM": loc} for loc in locations])
+    # Four phantom points, which never move
+    masters = [np.array(_points(layer) + [(0, 0)] * 4, dtype=float) for layer in layers]
+    size = 0
+    for delta, support in zip(model.getDeltas(masters), model.supports):
+        if support:
+            deltas = [(otRound(x), otRound(y)) for x, y in delta]
+            size += _tuple_size(TupleVariation(support, deltas), ["ANIM"])
+    return size
+
+
+class EncodingChooser:
+    """Decides, for each animated glyph, whether its keyframes are stored as
+    gvar point deltas or as one static outline under a PaintVarTransform.
+
+    When every keyframe outline is an affine image of the first one, both
+    encodings draw the same thing: gvar interpolates each point linearly
+    between keyframes, and interpolating the matrix linearly moves every
+    point the same way. The choice is then made on the estimated size of
+    each encoding plus the cost of interpolating its values at render time.
+    Glyphs painted with a gradient keep their gvar, as transforming the
+    PaintGlyph would move the gradient too.
+
+    `timeline` is the timeline which the glyphs' keyframe times were
+    snapped through.
+    """
+
+    def __init__(self, timeline, quantizer, tolerance=RIGID_TOLERANCE):
+        self.timeline = timeline
+        self.quantizer = quantizer
+        self.tolerance = tolerance
+        self._candidates = {}
+        self._choices = {}
+
+    def analyse(self, glyphname, glyph):
+        """Looks for a rigid motion in a freshly built glyph's variations."""
+        variations = glyph.get("variations")
+        if not variations or len(variations) < 2:
+            return
+        times = sorted(variations)
+        base = _points(variations[times[0]])
+        if any(len(_points(layer)) != len(base) for layer in variations.values()):
+            self._choices[glyphname] = "incompatible keyframes; gvar"
+            return
+        matrices = []
+        worst = 0
+        for time in times:
+            matrix, error = affine_fit(base, _points(variations[time]))
+            worst = max(worst, error)
+            if worst > self.tolerance:
+                self._choices[glyphname] = f"not rigid (error {worst:.2f}); gvar"
+                return
+            matrices.append(matrix)
+
+        # Keyframe times are on the ANIM axis, which is normalized as in
+        # font.compile_glyph; when packing, the axis is the longest
+        # animation's, not this one's.
+        locations = [time / self.timeline.end for time in times]
+        layers = [variations[time] for time in times]
+        if 0 not in locations:
+            locations.insert(0, 0)
+            layers.insert(0, layers[0])
+        gvar_size = gvar_bytes(layers, locations)
+        gvar_render = 2 * (len(base) + 4) * ACTIVE_REGIONS
+
+        matrices = np.array(matrices)
+        varying = np.count_nonzero(np.any(matrices != matrices[0], axis=0))
+        colr_size = VAR_TRANSFORM_BYTES + varying * FIXED_DELTA_BYTES * (len(locations) - 1)
+        colr_render = varying * ACTIVE_REGIONS
+
+        gvar_cost = gvar_size + RENDER_WEIGHT * gvar_render
+        colr_cost = colr_size + RENDER_WEIGHT * colr_render
+        summary = (
+            f"rigid; gvar ~{gvar_size} bytes/{gvar_render} values, "
+            f"COLR transform ~{colr_size} bytes/{colr_render} values"
+        )
+        if colr_cost < gvar_cost:
+            self._candidates[glyphname] = (times, matrices, summary)
+        else:
+            self._choices[glyphname] = summary + "; gvar"
+
+    def transform(self, glyphname, glyph, solid):
+        """Returns the matrix to paint a glyph with, if it is to be encoded as
+        a variable transform, and drops the glyph's variations. `solid` says
+        whether the glyph has a solid fill."""
+        if glyphname not in self._candidates:
+            return None
+        times, matrices, summary = self._candidates.pop(glyphname)
+        if not solid:
+            self._choices[glyphname] = summary + "; gvar (gradient fill)"
+            return None
+        self._choices[glyphname] = summary + "; COLR transform"
+        glyph["base"] = glyph.pop("variations")[times[0]]
+        matrices[:, :4] = self.quantizer.scale(matrices[:, :4])
+        matrices[:, 4:] = self.quantizer.coord(matrices[:, 4:])
+        # The outline is now drawn under these matrices
+        linear = matrices[:, :4].reshape(-1, 2, 2)
+        glyph["magnification"] = glyph.get("magnification", 1) * float(
+            np.max(np.linalg.norm(linear, 2, axis=(1, 2)))
+        )
+        return values_to_ot(times, matrices)
+
+    @property
+    def choices(self):
+        """The encoding chosen for each animated glyph, with the reason."""
+        choices = dict(self._choices)
+        # Candidates which were never painted keep their gvar
+        for glyphname, (_, _, summary) in self._candidates.items():
+            choices[glyphname] = summary + "; gvar (not painted)"
+        return choices
+
+
+def print_report(choices):
+    for glyphname, choice in sorted(choices.items()):
+        print(f"{glyphname}: {choice}")
+    chosen = sum(1 for choice in choices.values() if choice.endswith("COLR transform"))
+    print(f"{chosen} of {len(choices)} animated glyphs encoded as COLR transforms")
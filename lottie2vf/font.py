@@ -6,7 +6,9 @@ from cu2qu.ufo import glyphs_to_quadratic
 from fontTools.ttLib.tables.TupleVariation import TupleVariation
 from fontTools.ttLib.tables._g_l_y_f import GlyphCoordinates
 from fontTools.varLib.models import VariationModel
+from fontTools.varLib.iup import iup_delta_optimize
 from fontTools.misc.fixedTools import otRound
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 
 
@@ -28,9 +30,35 @@ def font_builder(an):
     return fb
 
 
-def add_glyphs(fb, glyphs):
+def add_glyphs(
+    fb,
+    glyphs,
+    iup_tolerance=None,
+    jobs=None,
+    cache=None,
+    base_glyphs=None,
+    quantizer=None,
+    compiled=None,
+):
+    """Adds the glyphs to the font.
+
+    `base_glyphs` maps the names of the (empty) base glyphs which carry the
+    COLR paints to their codepoints; by default there is one, "baseglyph",
+    on U+0061.
+
+    If a `quantizer` is given, the outlines are snapped to its grid once they
+    have been converted to quadratics.
+
+    Glyphs named in `compiled` have already been through `compile_glyph`
+    (in a worker process, say) and their descriptions are not used.
+
+    If a `cache` dictionary is given, glyphs whose description is the same
+    object as on the previous call are not recompiled, and the cache is
+    updated with this call's compiled glyphs."""
+    if base_glyphs is None:
+        base_glyphs = {"baseglyph": 0x61}
     glyf = {}
-    fb.setupGlyphOrder([".notdef", "baseglyph"] + list(glyphs.keys()))
+    fb.setupGlyphOrder([".notdef"] + list(base_glyphs) + list(glyphs.keys()))
 
     # This zero is clearly wrong
 
@@ -39,41 +67,51 @@ def add_glyphs(fb, glyphs):
     # Empty glyf base glyph
     pen = TTGlyphPen(None)
     glyphset[".notdef"] = pen.glyph()
-    glyphset["baseglyph"] = pen.glyph()
+    for base_glyph in base_glyphs:
+        glyphset[base_glyph] = pen.glyph()
     variations = {}
+    new_variations = {}
 
-    metrics = {".notdef": (0, fb._an.width), "baseglyph": (0, fb._an.width)}
+    metrics = {".notdef": (0, fb._an.width)}
+    for base_glyph in base_glyphs:
+        metrics[base_glyph] = (0, fb._an.width)
     for glyphname, glyph in glyphs.items():
-        if glyph.get("variations"):
-            keyframes = list(sorted(glyph["variations"].keys()))
-            glyphs_to_quadratic(glyph["variations"].values(), reverse_direction=True)
-            glyph["base"] = glyph["variations"][keyframes[0]]
-            frames = [{"ANIM": k / fb._an.out_point} for k in keyframes]
-            ttglyphs = []
-            if {"ANIM": 0} not in frames:
-                pen = TTGlyphPen(None)
-                glyph["base"].draw(pen)
-                ttglyphs.append(pen.glyph())
-                frames.insert(0, {"ANIM": 0})
-            model = VariationModel(frames)
-            for k in keyframes:
-                pen = TTGlyphPen(None)
-                glyph["variations"][k].draw(pen)
-                ttglyphs.append(pen.glyph())
-            variations[glyphname] = calculate_a_gvar(glyphname, fb, model, ttglyphs)
+        if cache and glyphname in cache and cache[glyphname][0] is glyph:
+            glyphset[glyphname], metrics[glyphname], gvar_entry = cache[glyphname][1]
+            if gvar_entry is not None:
+                variations[glyphname] = gvar_entry
+            continue
+        if compiled and glyphname in compiled:
+            entry = compiled[glyphname]
         else:
-            glyphs_to_quadratic([glyph["base"]], reverse_direction=True)
-        pen = TTGlyphPen(None)
-        glyph["base"].draw(pen)
-        glyphset[glyphname] = pen.glyph()
+            entry = compile_glyph(glyphname, glyph, fb, quantizer)
+        glyphset[glyphname], metrics[glyphname], gvar_entry = entry
+        if gvar_entry is not None:
+            new_variations[glyphname] = gvar_entry
 
-        metrics[glyphname] = (fb._an.width, glyph["base"].lsb)
+    if new_variations and iup_tolerance is not None:
+        new_variations = optimize_gvar(
+            fb, glyphset, new_variations, iup_tolerance, jobs
+        )
+    variations.update(new_variations)
+
+    if cache is not None:
+        cache.clear()
+        for glyphname, glyph in glyphs.items():
+            entry = (
+                glyphset[glyphname],
+                metrics[glyphname],
+                variations.get(glyphname),
+            )
+            cache[glyphname] = (glyph, entry)
 
     fb.setupHorizontalMetrics(metrics)
     fb.setupGlyf(glyphset)
     if variations:
-        fb.setupGvar(variations)
-    fb.setupCharacterMap({97: "baseglyph"})
+        fb.setupGvar({g: variations[g] for g in glyphs if g in variations})
+    fb.setupCharacterMap(
+        {codepoint: base_glyph for base_glyph, codepoint in base_glyphs.items()}
+    )
     fb.setupOS2(
         sTypoAscender=fb._an.height,
         sTypoDescender=0,
@@ -90,15 +128,102 @@ def add_glyphs(fb, glyphs):
     pass
 
 
-def calculate_a_gvar(g, fb, model, ttglyphs):
-    all_coords = []
-    for ttglyph in ttglyphs:
-        basecoords = GlyphCoordinates(ttglyph.coordinates)
-        phantomcoords = GlyphCoordinates(
-            [(0, 0), (otRound(fb._an.width), 0), (0, 0), (0, 0)]
+def compile_glyph(glyphname, glyph, fb, quantizer=None):
+    """Converts a glyph description to quadratics and compiles it.
+
+    Returns the TrueType glyph, its metrics and its gvar entry (None if the
+    glyph is not animated)."""
+    gvar_entry = None
+    if glyph.get("variations"):
+        keyframes = list(sorted(glyph["variations"].keys()))
+        glyphs_to_quadratic(glyph["variations"].values(), reverse_direction=True)
+        if quantizer:
+            for layer in glyph["variations"].values():
+                quantize_layer(layer, quantizer, glyph.get("magnification", 1))
+        glyph["base"] = glyph["variations"][keyframes[0]]
+        frames = [{"ANIM": k / fb._an.out_point} for k in keyframes]
+        ttglyphs = []
+        if {"ANIM": 0} not in frames:
+            pen = TTGlyphPen(None)
+            glyph["base"].draw(pen)
+            ttglyphs.append(pen.glyph())
+            frames.insert(0, {"ANIM": 0})
+        model = VariationModel(frames)
+        for k in keyframes:
+            pen = TTGlyphPen(None)
+            glyph["variations"][k].draw(pen)
+            ttglyphs.append(pen.glyph())
+        gvar_entry = calculate_a_gvar(glyphname, fb, model, ttglyphs)
+    else:
+        glyphs_to_quadratic([glyph["base"]], reverse_direction=True)
+        if quantizer:
+            quantize_layer(glyph["base"], quantizer, glyph.get("magnification", 1))
+    pen = TTGlyphPen(None)
+    glyph["base"].draw(pen)
+    return pen.glyph(), (fb._an.width, glyph["base"].lsb), gvar_entry
+
+
+def quantize_layer(layer, quantizer, magnification=1):
+    """Snaps an outline to the quantizer's grid. `magnification` is how much
+    the paints above the glyph scale it up at most."""
+    with quantizer.magnified(magnification):
+        for shape in layer.shapes:
+            for node in shape.nodes:
+                node.x, node.y = quantizer.point(node.x, node.y)
+
+
+def _outline_key(layer):
+    return tuple(
+        tuple((node.x, node.y, node.type) for node in shape.nodes)
+        for shape in layer.shapes
+    )
+
+
+def dedupe_glyphs(glyphs):
+    """Merges glyphs whose outlines are identical at every keyframe.
+
+    Must be called before `add_glyphs`, which converts the outlines to
+    quadratics in place. Returns the remaining glyphs and a dictionary
+    mapping the names of the dropped glyphs to the glyphs they duplicate."""
+    unique = {}
+    aliases = {}
+    seen = {}
+    for glyphname, glyph in glyphs.items():
+        if glyph.get("paint_only"):
+            # Outline-less glyphs carrying a repeated paint are all different
+            unique[glyphname] = glyph
+            continue
+        key = (
+            _outline_key(glyph["base"]),
+            tuple(
+                (time, _outline_key(layer))
+                for time, layer in sorted(glyph.get("variations", {}).items())
+            ),
         )
-        basecoords.extend(phantomcoords)
-        all_coords.append(basecoords)
+        if key in seen:
+            aliases[glyphname] = seen[key]
+            # The glyph kept is drawn wherever the duplicate was
+            kept = unique[seen[key]]
+            kept["magnification"] = max(
+                kept.get("magnification", 1), glyph.get("magnification", 1)
+            )
+        else:
+            seen[key] = glyphname
+            unique[glyphname] = glyph
+    return unique, aliases
+
+
+def glyph_coordinates(ttglyph, fb):
+    basecoords = GlyphCoordinates(ttglyph.coordinates)
+    phantomcoords = GlyphCoordinates(
+        [(0, 0), (otRound(fb._an.width), 0), (0, 0), (0, 0)]
+    )
+    basecoords.extend(phantomcoords)
+    return basecoords
+
+
+def calculate_a_gvar(g, fb, model, ttglyphs):
+    all_coords = [glyph_coordinates(ttglyph, fb) for ttglyph in ttglyphs]
     for ix, c in enumerate(all_coords):
         all_ok = True
         if len(c) != len(all_coords[0]):
@@ -111,7 +236,6 @@ def calculate_a_gvar(g, fb, model, ttglyphs):
         round=partial(GlyphCoordinates.__round__, round=round),
     )
     gvar_entry = []
-    endPts = ttglyphs[0].endPtsOfContours
 
     for delta, sup in zip(deltas, model.supports):
         if not sup:
@@ -119,3 +243,60 @@ def calculate_a_gvar(g, fb, model, ttglyphs):
         var = TupleVariation(sup, delta)
         gvar_entry.append(var)
     return gvar_entry
+
+
+def _tuple_size(var, axis_tags):
+    tupleData, auxData = var.compile(axis_tags)
+    return len(tupleData) + len(auxData)
+
+
+def _iup_optimize_glyph(args):
+    glyphname, coords, endPts, gvar_entry, tolerance = args
+    axis_tags = ["ANIM"]
+    before = after = 0
+    optimized = []
+    for var in gvar_entry:
+        size = _tuple_size(var, axis_tags)
+        before += size
+        deltas = iup_delta_optimize(
+            var.coordinates, coords, endPts, tolerance=tolerance
+        )
+        if None in deltas:
+            var_opt = TupleVariation(var.axes, deltas)
+            opt_size = _tuple_size(var_opt, axis_tags)
+            if opt_size < size:
+                var, size = var_opt, opt_size
+        after += size
+        optimized.append(var)
+    return glyphname, optimized, before - after
+
+
+def optimize_gvar(fb, glyphset, variations, tolerance, jobs=None):
+    """Drops point deltas which can be inferred by IUP within `tolerance`.
+
+    Glyphs are optimized in parallel across `jobs` worker processes (one per
+    CPU by default), and the bytes saved for each glyph are reported."""
+    work = [
+        (
+            glyphname,
+            list(glyph_coordinates(glyphset[glyphname], fb)),
+            list(glyphset[glyphname].endPtsOfContours),
+            gvar_entry,
+            tolerance,
+        )
+        for glyphname, gvar_entry in variations.items()
+    ]
+    if jobs == 1 or len(work) < 2:
+        results = map(_iup_optimize_glyph, work)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_iup_optimize_glyph, work))
+
+    optimized = {}
+    total = 0
+    for glyphname, gvar_entry, saved in results:
+        optimized[glyphname] = gvar_entry
+        total += saved
+        print(f"IUP optimization saved {saved} bytes in {glyphname}")
+    print(f"IUP optimization saved {total} bytes in total")
+    return optimized
@@ -0,0 +1,214 @@
+import numpy as np
+from lottie.objects.base import LottieObject
+from lottie.objects.properties import AnimatableMixin
+
+
+__all__ = ["KeyframeStore", "PropertyColumns", "keyframe_times"]
+
+
+# Lottie's default easing is linear, i.e. handles on the diagonal
+_LINEAR_OUT = (0.0, 0.0)
+_LINEAR_IN = (1.0, 1.0)
+
+
+class PropertyColumns:
+    """The keyframes of one animated property, as contiguous arrays.
+
+    ``times`` holds the keyframe times and ``values`` one row of components
+    per keyframe; keyframes without a start value (older Lottie files put the
+    final value in the previous keyframe's ``end``) are dropped. The easing
+    handles of each segment are in ``out_x``/``out_y`` (leaving the keyframe)
+    and ``in_x``/``in_y`` (arriving at the next one), and ``hold`` marks
+    segments which jump rather than interpolate. Position keyframes may also
+    have spatial tangents (``out_tan``/``in_tan``, relative to the start and
+    end values) which bend the path between them; ``spatial`` marks those.
+    """
+
+    def __init__(self, keyframes):
+        keyframes = [k for k in keyframes if k.start is not None]
+        width = len(keyframes[0].start.components) if keyframes else 0
+        # One row per keyframe, turned into one array and then split into
+        # columns, as making a separate array per column is slow for the
+        # handful of keyframes most properties have.
+        zero = (0.0,) * width
+        rows = [_row(k, zero) for k in keyframes]
+        columns = np.array(rows, dtype=float).reshape(len(keyframes), 7 + 3 * width).T.copy()
+        self.times = columns[0]
+        # Like lottie, a segment without easing handles holds its value
+        self.hold = columns[1] != 0
+        self.spatial = columns[2] != 0
+        self.out_x, self.out_y, self.in_x, self.in_y = columns[3:7]
+        self.values = columns[7 : 7 + width].T
+        self.out_tan = columns[7 + width : 7 + 2 * width].T
+        self.in_tan = columns[7 + 2 * width :].T
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def components(self):
+        return self.values.shape[1]
+
+    def sample(self, times):
+        """Evaluates the property at each of `times`, following the easing."""
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        if len(self) == 1:
+            return np.repeat(self.values, len(times), axis=0)
+        segment = np.clip(np.searchsorted(self.times, times, side="right") - 1, 0, len(self) - 2)
+        t0 = self.times[segment]
+        t1 = self.times[segment + 1]
+        ratio = np.clip((times - t0) / np.where(t1 > t0, t1 - t0, 1), 0, 1)
+        eased = _ease(
+            ratio,
+            self.out_x[segment],
+            self.out_y[segment],
+            self.in_x[segment],
+            self.in_y[segment],
+        )
+        # Bisection is not exact at the ends; keyframes hit their values
+        eased = np.where(ratio >= 1, 1, np.where(ratio <= 0, 0, eased))
+        eased = np.where(self.hold[segment] & (ratio < 1), 0, eased)
+        v0 = self.values[segment]
+        v1 = self.values[segment + 1]
+        linear = v0 + (v1 - v0) * eased[:, None]
+        if not self.spatial.any():
+            return linear
+        # Spatial tangents: a cubic from v0 (leaving along out_tan) to v1
+        # (arriving along in_tan). Players follow it at the eased rate, which
+        # we approximate by evaluating it at the eased parameter.
+        # Written relative to v0, so components which do not move stay exact.
+        t = eased[:, None]
+        c1 = self.out_tan[segment]
+        c2 = v1 - v0 + self.in_tan[segment]
+        curved = v0 + (
+            3 * (1 - t) ** 2 * t * c1
+            + 3 * (1 - t) * t ** 2 * c2
+            + t ** 3 * (v1 - v0)
+        )
+        return np.where(self.spatial[segment][:, None], curved, linear)
+
+
+def _row(k, zero):
+    out_handle, in_handle = k.out_value, k.in_value
+    out_tan = getattr(k, "out_tan", None)
+    in_tan = getattr(k, "in_tan", None)
+    return (
+        k.time,
+        bool(k.hold or not (in_handle and out_handle)),
+        bool(out_tan and in_tan),
+        *((out_handle.x, out_handle.y) if out_handle else _LINEAR_OUT),
+        *((in_handle.x, in_handle.y) if in_handle else _LINEAR_IN),
+        *k.start.components,
+        *_tangent(out_tan, zero),
+        *_tangent(in_tan, zero),
+    )
+
+
+def _tangent(tangent, zero):
+    if not tangent:
+        return zero
+    return (tuple(tangent.components) + zero)[: len(zero)]
+
+
+def _bezier(t, c1, c2):
+    return ((1 - 3 * c2 + 3 * c1) * t + (3 * c2 - 6 * c1)) * t * t + 3 * c1 * t
+
+
+def _ease(x, h1x, h1y, h2x, h2y, iterations=30):
+    # The easing curve runs from (0, 0) to (1, 1) with handles h1 and h2 and
+    # x(t) is monotonic, so bisection finds the t for each x.
+    lo = np.zeros_like(x)
+    hi = np.ones_like(x)
+    for _ in range(iterations):
+        mid = (lo + hi) / 2
+        below = _bezier(mid, h1x, h2x) < x
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid)
+    return _bezier((lo + hi) / 2, h1y, h2y)
+
+
+class KeyframeStore:
+    """Columnar copies of every animated (non-shape) property in an animation,
+    built in one pass so that conversion stages can work on whole arrays
+    instead of going through lottie's keyframe objects.
+
+    ``times`` holds every distinct keyframe time in the animation, those of
+    shapes included, for the `Timeline` to be built from."""
+
+    def __init__(self, animation):
+        self._columns = {}
+        self._matrices = {}
+        self._warned = {}
+        times = []
+        for prop in _animated_properties(animation):
+            keyframes = prop.keyframes
+            times.extend(k.time for k in keyframes)
+            first = next((k.start for k in keyframes if k.start is not None), None)
+            if not hasattr(first, "components"):
+                continue  # Shapes are handled as glyph outlines
+            self._columns[id(prop)] = (prop, PropertyColumns(keyframes))
+        self.times = np.unique(np.array(times, dtype=float))
+
+    def __getitem__(self, prop):
+        return self._columns[id(prop)][1]
+
+    def __contains__(self, prop):
+        return id(prop) in self._columns
+
+    def __len__(self):
+        return len(self._columns)
+
+    def matrix(self, transform):
+        """The matrix of a static transform. A layer's transform is applied
+        to each of its groups, and lottie is slow to work it out."""
+        if id(transform) not in self._matrices:
+            self._matrices[id(transform)] = (transform, transform.to_matrix(0))
+        return self._matrices[id(transform)][1]
+
+    def first_warning(self, prop):
+        """True the first time it is called for `prop`, so that a warning
+        about a property is not repeated each time the property is used."""
+        if id(prop) in self._warned:
+            return False
+        self._warned[id(prop)] = prop
+        return True
+
+
+# Lottie object class -> names of its properties which can hold other objects
+_CHILDREN = {}
+
+
+def _children(cls):
+    names = _CHILDREN.get(cls)
+    if names is None:
+        names = _CHILDREN[cls] = [
+            prop.name
+            for prop in cls._props
+            if isinstance(prop.type, type) and issubclass(prop.type, LottieObject)
+        ]
+    return names
+
+
+def keyframe_times(obj):
+    """The set of keyframe times of every animated property in a Lottie
+    object (an animation, a layer...), those of shapes included."""
+    return {k.time for prop in _animated_properties(obj) for k in prop.keyframes}
+
+
+def _animated_properties(animation):
+    # Like animation.find_all(AnimatableMixin), but only following properties
+    # which can hold objects, and not looking inside the properties found
+    # (at their keyframes), which is most of the tree.
+    stack = [animation]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, AnimatableMixin):
+            if obj.animated and obj.keyframes:
+                yield obj
+            continue
+        for name in _children(type(obj)):
+            value = getattr(obj, name)
+            if isinstance(value, list):
+                stack.extend(v for v in value if v is not None)
+            elif value is not None:
+                stack.append(value)
@@ -6,23 +6,35 @@ import sys
 import logging
 from babelfont import Layer
 import math
-
-from .transformation import apply_transform_to_paint, animated_value_to_ot
+from itertools import groupby
+from pathlib import Path
+
+from .transformation import (
+    apply_transform_to_paint,
+    animated_value_to_ot,
+    transform_magnification,
+)
+from .timeline import Timeline, DEFAULT_EPSILON
+from .quantize import Quantizer
+from .keyframes import KeyframeStore
+from .dotlottie import DotLottie, is_dotlottie
+from .encoding import EncodingChooser
+from .repeater import repeater_copies, copies_magnification, copy_to_paint
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["LottieParser", "load_animation"]
+__all__ = ["LottieParser", "load_animation", "load_animations"]
 
 
 def color_to_string(color):
     return "#%02X%02X%02X%02X" % tuple([int(x * 255) for x in color.components])
 
 
-def fill_to_paint(fill, opacity, animation):
+def fill_to_paint(fill, opacity, keyframes, timeline, quantizer):
     if not fill:
         return
     if isinstance(fill, objects.GradientFill):
-        return gradient_fill_to_paint(fill, opacity, animation)
+        return gradient_fill_to_paint(fill, opacity, quantizer)
     if fill.color.animated:
         logger.warning(f"Animated colour not supported")
         color = fill.color.get_value(0)
@@ -34,23 +46,16 @@ def fill_to_paint(fill, opacity, animation):
     if fill.opacity.animated and opacity.animated:
         raise NotImplementedError
     if opacity.animated:
-        opacity = opacity.clone()
-        for k in opacity.keyframes:
-            if not k.start:
-                continue
-            k.start /= 100
-            k. start *= fill.opacity.value / 100
-        alpha = animated_value_to_ot(opacity.keyframes, animation)
+        fill_opacity = fill.opacity.value / 100
+        alpha = animated_value_to_ot(
+            keyframes[opacity], timeline, lambda v: v / 100 * fill_opacity
+        )
         return f"PaintVarSolid( '{color_string}', {alpha[0]} )"
     elif fill.opacity.animated:
-        opacity = fill.opacity.clone()
-        for k in opacity.keyframes:
-            if not k.start:
-                continue
-            k.start /= 100
-            k. start *= opacity.value / 100
-        alpha = animated_value_to_ot(opacity.keyframes, animation)
-
+        layer_opacity = opacity.value / 100
+        alpha = animated_value_to_ot(
+            keyframes[fill.opacity], timeline, lambda v: v / 100 * layer_opacity
+        )
         return f"PaintVarSolid( '{color_string}', {alpha[0]} )"
     else:
         opacity = fill.opacity.value / 100 * opacity.value / 100
@@ -60,27 +65,36 @@ def fill_to_paint(fill, opacity, animation):
         return f"PaintSolid( '{color_string}'{alpha} )"
 
 
-def gradient_fill_to_paint(fill, opacity, animation):
+def gradient_fill_to_paint(fill, opacity, quantizer):
     if fill.gradient_type != objects.shapes.GradientType.Linear:
         pass  # raise NotImplementedError
     line = {stop: color_to_string(col) for stop, col in fill.colors.get_stops(None)}
     if fill.start_point.animated or fill.end_point.animated:
         raise NotImplementedError
-    start_x, start_y = fill.start_point.get_value(0).components[:2]
-    end_x, end_y = fill.end_point.get_value(0).components[:2]
+    start_x, start_y = quantizer.point(*fill.start_point.get_value(0).components[:2])
+    end_x, end_y = quantizer.point(*fill.end_point.get_value(0).components[:2])
     angle = (fill.start_point.value - fill.end_point.value).polar_angle + math.pi / 2
     mid_x, mid_y = start_x + math.cos(angle) * 10, start_y + math.sin(angle) * 10
     return f"PaintLinearGradient( ({start_x},{start_y}), ({end_x}, {end_y}), ({mid_x}, {mid_y}), ColorLine({line}))"
 
 
-def paint_all_shapes(shapes, fill):
-    layers = [f'PaintGlyph("{s}", {fill})' for s in shapes]
-    if len(shapes) == 1:
+def layers_to_paint(layers):
+    if len(layers) == 1:
         return layers[0]
-
     return "PaintColrLayers([" + ", ".join(layers) + "])"
 
 
+def paint_all_shapes(shapes, fill, transforms=None):
+    layers = [f'PaintGlyph("{s}", {fill})' for s in shapes]
+    if transforms:
+        layers = [
+            f"PaintVarTransform( ({', '.join(map(str, transforms[s]))}), {layer})"
+            if transforms.get(s) else layer
+            for s, layer in zip(shapes, layers)
+        ]
+    return layers_to_paint(layers)
+
+
 def _bezier_tangent(tangent):
     _tangent_threshold = 0.5
     if tangent.length < _tangent_threshold:
@@ -111,19 +125,51 @@ def bez_to_layer(path, t):
     return layer
 
 
+def glyph_name(ix):
+    """The name of the `ix`th (zero-based) outline glyph."""
+    return "glyph%04i" % (1 + ix)
+
+
 class LottieParser(restructure.AbstractBuilder):
-    def __init__(self, animation):
+    def __init__(self, animation, epsilon=DEFAULT_EPSILON, timeline=None, glyphs=None, grid=None, keyframes=None, choose_encoding=False):
         super().__init__()
-        self.keyframes = set()
+        self.epsilon = epsilon
+        self.timeline = timeline
+        self.keyframes = keyframes
+        self.quantizer = Quantizer(grid, animation)
+        self.choose_encoding = choose_encoding
+        self.encodings = None
+        # Parsers packing several animations into one font share a glyph
+        # dictionary, so that glyph names are unique across all of them.
+        self._shared_glyphs = glyphs
         self._precomps = {}
+        self._copies = {}
         self.animation = animation
 
     def process(self):
+        if self.keyframes is None:
+            self.keyframes = KeyframeStore(self.animation)
+        if self.timeline is None:
+            self.timeline = Timeline(self.animation, self.epsilon, [self.keyframes])
+        if self.choose_encoding:
+            self.encodings = EncodingChooser(self.timeline, self.quantizer)
         super().process(self.animation)
 
+    def restructure_shapegroup(self, shape, shape_group, merge_paths):
+        # A repeater repeats everything above it in its group, not just the
+        # shape right above it, so its "child" is the list of all of them.
+        if isinstance(shape, objects.Repeater):
+            if shape_group.children:
+                children = shape_group.children
+                shape_group.children = []
+                shape_group.add(restructure.RestructuredModifier(shape, children))
+            return
+        super().restructure_shapegroup(shape, shape_group, merge_paths)
+
     def _on_animation(self, animation):
         # print("On animation", animation)
-        self.result = {"layer_transform": None, "paints": [], "glyphs": {}}
+        glyphs = self._shared_glyphs if self._shared_glyphs is not None else {}
+        self.result = {"layer_transform": None, "paints": [], "glyphs": glyphs}
         return self.result
 
     def _on_precomp(self, id, dom_parent, layers):
@@ -161,23 +207,64 @@ class LottieParser(restructure.AbstractBuilder):
     def _on_shapegroup(self, group, dom_parent):
         # print("Visiting shapegroup", group, dom_parent)
         group.paths = []
+        # Glyph name -> the repeaters it is inside, innermost first
+        group.repeats = {}
         self.shapegroup_process_children(group, dom_parent)
         if not group.fill:
             logger.warn("Shape group with no fill in " + str(group))
             return
-        # Check fill, lottie.transform, layer transform
-        res = apply_transform_to_paint(
-            group.lottie.transform,
-            paint_all_shapes(group.paths, fill_to_paint(group.fill, group.lottie.transform.opacity, self.animation)),
-            self.animation,
-        )
-        if dom_parent["layer_transform"]:
+        layer_transform = dom_parent["layer_transform"]
+        transform = group.lottie.transform
+        with self.quantizer.magnified(transform_magnification(layer_transform, self.keyframes)):
+            with self.quantizer.magnified(transform_magnification(transform, self.keyframes)):
+                layers = self.paint_shapes(group)
+            # Check fill, lottie.transform, layer transform
+            res = apply_transform_to_paint(
+                transform,
+                layers_to_paint(layers),
+                self.keyframes,
+                self.timeline,
+                self.quantizer,
+            )
+        if layer_transform:
             res = apply_transform_to_paint(
-                dom_parent["layer_transform"], res, self.animation
+                dom_parent["layer_transform"], res, self.keyframes, self.timeline, self.quantizer
             )
         dom_parent["paints"].append(res)
         return res
 
+    def paint_shapes(self, group):
+        """Paints the shapes of a group with its fill, repeating those inside
+        repeaters, and returns the list of paints.
+
+        Each glyph is told how much the repeaters (and any variable transform
+        it gets) scale it up, for the quantizer's error when its outline is
+        snapped."""
+        solid = not isinstance(group.fill, objects.GradientFill)
+        runs = []
+        for repeaters, paths in groupby(group.paths, lambda path: group.repeats.get(path, [])):
+            scales = [copies_magnification(self.copies(repeater)[1]) for repeater in repeaters]
+            runs.append((list(paths), repeaters, scales))
+        with self.quantizer.magnified(max((math.prod(scales) for *_, scales in runs), default=1)):
+            fill = fill_to_paint(group.fill, group.lottie.transform.opacity, self.keyframes, self.timeline, self.quantizer)
+        layers = []
+        for paths, repeaters, scales in runs:
+            transforms = {}
+            with self.quantizer.magnified(math.prod(scales)):
+                for path in paths:
+                    self.glyphs[path]["magnification"] = self.quantizer.magnification
+                    if self.encodings:
+                        transforms[path] = self.encodings.transform(path, self.glyphs[path], solid)
+            paint = paint_all_shapes(paths, fill, transforms)
+            for ix, repeater in enumerate(repeaters):
+                if paint:
+                    # Outer repeaters scale up the inner ones' values
+                    with self.quantizer.magnified(math.prod(scales[ix + 1 :])):
+                        paint = self.repeat(repeater, paint)
+            if paint:
+                layers.append(paint)
+        return layers
+
     def _on_merged_path(self, shape, shapegroup, out_parent):
         # print("Visiting merged path", shape, shapegroup, out_parent)
         pass
@@ -194,11 +281,12 @@ class LottieParser(restructure.AbstractBuilder):
         return
 
     def to_glyph(self, path, orig_shape):
-        newglyph = "glyph%04i" % (1 + len(self.result["glyphs"]))
+        newglyph = glyph_name(len(self.result["glyphs"]))
         self.result["glyphs"][newglyph] = {"base": bez_to_layer(path, 0)}
         if path.shape.animated:
+            times = sorted({self.timeline.snap(k.time) for k in path.shape.keyframes})
             self.result["glyphs"][newglyph]["variations"] = {
-                k.time: bez_to_layer(path, k.time) for k in path.shape.keyframes
+                t: bez_to_layer(path, self.timeline.from_axis(t)) for t in times
             }
             layers = list(self.result["glyphs"][newglyph]["variations"].values())
             if not all(
@@ -209,24 +297,86 @@ class LottieParser(restructure.AbstractBuilder):
                 import IPython
 
                 IPython.embed()
+            if self.encodings:
+                self.encodings.analyse(newglyph, self.result["glyphs"][newglyph])
         return newglyph
 
     def _on_shape_modifier(self, shape, shapegroup, out_parent):
-        print("Visiting shape modifier", shape, shapegroup, out_parent)
+        # print("Visiting shape modifier", shape, shapegroup, out_parent)
         if isinstance(shape.lottie, objects.Repeater):
-            svgshape = self.build_repeater(
+            return self.build_repeater(
                 shape.lottie, shape.child, shapegroup, out_parent
             )
         elif isinstance(shape.lottie, objects.RoundedCorners):
-            svgshape = self.build_rounded_corners(
-                shape.lottie, shape.child, shapegroup, out_parent
-            )
+            print("Rounded corners not supported yet")
+            return self.shapegroup_process_child(shape.child, shapegroup, out_parent)
         elif isinstance(shape.lottie, objects.Trim):
             print("Trim path not supported yet")
             return self.shapegroup_process_child(shape.child, shapegroup, out_parent)
         else:
             return self.shapegroup_process_child(shape.child, shapegroup, out_parent)
-        return []
+
+    def build_repeater(self, repeater, children, shapegroup, out_parent):
+        # Shapes are painted with their group's fill, so are only marked as
+        # repeated here; the paints of subgroups are repeated straight away.
+        # Those come out with the layer transform applied, which has to go
+        # outside the repeater's transforms instead.
+        paths = shapegroup.paths if shapegroup.paths is not None else []
+        first_path = len(paths)
+        first_paint = len(out_parent["paints"])
+        layer_transform = out_parent["layer_transform"]
+        out_parent["layer_transform"] = None
+        with self.quantizer.magnified(transform_magnification(layer_transform, self.keyframes)):
+            with self.quantizer.magnified(copies_magnification(self.copies(repeater)[1])):
+                for child in children:
+                    self.shapegroup_process_child(child, shapegroup, out_parent)
+            out_parent["layer_transform"] = layer_transform
+
+            for path in paths[first_path:]:
+                shapegroup.repeats.setdefault(path, []).append(repeater)
+            paints = out_parent["paints"][first_paint:]
+            del out_parent["paints"][first_paint:]
+            if not paints:
+                return
+            res = self.repeat(repeater, layers_to_paint(paints))
+        if res is None:
+            return
+        if layer_transform:
+            res = apply_transform_to_paint(
+                layer_transform, res, self.keyframes, self.timeline, self.quantizer
+            )
+        out_parent["paints"].append(res)
+
+    def repeat(self, repeater, paint):
+        """Paints the copies of `paint` made by a repeater, or returns None
+        if it makes none.
+
+        With more than one copy, the paint goes into a glyph of its own
+        (without an outline) which each copy then refers to with
+        PaintColrGlyph, so the paint and its variations are only stored once
+        however many copies there are."""
+        times, copies = self.copies(repeater)
+        if not copies:
+            return None
+        references = [paint]
+        if len(copies) > 1:
+            name = glyph_name(len(self.result["glyphs"]))
+            self.result["glyphs"][name] = {"base": Layer(), "paint_only": True}
+            references = [f'PaintColrGlyph("{name}", {paint})'] + [
+                f'PaintColrGlyph("{name}")'
+            ] * (len(copies) - 1)
+        return layers_to_paint(
+            [
+                copy_to_paint(times, copy, reference, self.quantizer)
+                for copy, reference in zip(copies, references)
+            ]
+        )
+
+    def copies(self, repeater):
+        """The `repeater_copies` of a repeater, worked out once."""
+        if id(repeater) not in self._copies:
+            self._copies[id(repeater)] = repeater_copies(repeater, self.keyframes, self.timeline)
+        return self._copies[id(repeater)]
 
     @property
     def paint(self):
@@ -235,17 +385,31 @@ class LottieParser(restructure.AbstractBuilder):
         # def upside_down(p):
         #     return p
 
-        if len(self.result["paints"]) == 1:
-            return upside_down(self.result["paints"][0])
-
-        return upside_down(
-            "PaintColrLayers([" + ", ".join(self.result["paints"]) + "])"
-        )
+        return upside_down(layers_to_paint(self.result["paints"]))
 
     @property
     def glyphs(self):
         return self.result["glyphs"]
 
 
-def load_animation(path):
+def load_animation(path, index=0):
+    """Loads a Lottie JSON file, or the `index`th animation in a dotLottie
+    archive (without parsing the others)."""
+    if is_dotlottie(path):
+        with DotLottie(path) as archive:
+            return archive.load(archive.animation_ids[index])
     return objects.Animation.load(json.load(open(path)))
+
+
+def load_animations(path):
+    """Loads every animation in a Lottie file as a list of ``(name, Animation)``
+    pairs. The name is the file's stem, followed by the animation's id if the
+    file is a dotLottie archive holding more than one."""
+    path = Path(path)
+    if not is_dotlottie(path):
+        return [(path.stem, load_animation(path))]
+    with DotLottie(path) as archive:
+        animations = archive.animations()
+    if len(animations) == 1:
+        return [(path.stem, animations[0][1])]
+    return [(f"{path.stem}-{ix}", an) for ix, an in animations]
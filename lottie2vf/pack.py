@@ -0,0 +1,102 @@
+import re
+from lottie import objects
+
+from .lottieparser import LottieParser
+from .paintcompiler import compile_paints
+from .font import font_builder, add_glyphs, dedupe_glyphs
+from .timeline import Timeline, DEFAULT_EPSILON
+from .keyframes import KeyframeStore
+from .encoding import print_report
+
+__all__ = ["pack_animations", "base_glyph_names"]
+
+
+# Outline glyphs are named glyph0001, glyph0002... (see lottieparser.glyph_name)
+_OUTLINE_GLYPH_NAME = re.compile(r"glyph\d+")
+
+
+def base_glyph_names(animation_names):
+    """Makes a unique, valid glyph name for each animation, which cannot
+    clash with the names of the outline glyphs."""
+    names = []
+    for animation_name in animation_names:
+        name = re.sub(r"[^A-Za-z0-9_.]", "_", animation_name)
+        if (
+            not name
+            or name[0].isdigit()
+            or name[0] == "."
+            or _OUTLINE_GLYPH_NAME.fullmatch(name)
+        ):
+            name = "anim_" + name
+        base = name
+        suffix = 1
+        while name in names:
+            name = f"{base}.{suffix}"
+            suffix += 1
+        names.append(name)
+    return names
+
+
+def pack_animations(
+    animations,
+    base_glyphs,
+    epsilon=DEFAULT_EPSILON,
+    iup_tolerance=None,
+    jobs=None,
+    grid=None,
+    choose_encoding=False,
+    clip_boxes=False,
+):
+    """Packs several animations into a single font.
+
+    `base_glyphs` maps a base glyph name to a codepoint for each animation.
+    All the animations share one glyph set (with duplicate outlines merged),
+    one palette and one VarStore. Their frame ranges are stretched onto a
+    single ANIM axis, so they all loop over the same axis range.
+
+    Returns the font builder and the paint description."""
+    stores = [KeyframeStore(an) for an in animations]
+    timeline = Timeline(animations, epsilon, stores)
+    glyphs = {}
+    descriptions = []
+    quantizers = []
+    for an, store, base_glyph in zip(animations, stores, base_glyphs):
+        paint_builder = LottieParser(
+            an,
+            epsilon=epsilon,
+            timeline=timeline.for_animation(an),
+            keyframes=store,
+            glyphs=glyphs,
+            grid=grid,
+            choose_encoding=choose_encoding,
+        )
+        paint_builder.process()
+        quantizers.append(paint_builder.quantizer)
+        if paint_builder.encodings:
+            print_report(paint_builder.encodings.choices)
+        descriptions.append(f'glyphs["{base_glyph}"] = ' + paint_builder.paint)
+
+    # The font's own "animation" is just the shared canvas and axis
+    canvas = objects.Animation()
+    canvas.width = max(an.width for an in animations)
+    canvas.height = max(an.height for an in animations)
+    canvas.in_point = timeline.start
+    canvas.out_point = timeline.end
+
+    fontbuilder = font_builder(canvas)
+    glyphs, aliases = dedupe_glyphs(glyphs)
+    add_glyphs(
+        fontbuilder,
+        glyphs,
+        iup_tolerance=iup_tolerance,
+        jobs=jobs,
+        base_glyphs=base_glyphs,
+        quantizer=quantizers[0],
+    )
+    python_description = "\n".join(descriptions)
+    compile_paints(fontbuilder.font, python_description, aliases, clips=clip_boxes)
+
+    if grid:
+        max_error = max(quantizer.max_error for quantizer in quantizers)
+        print(f"Quantized to a {grid} unit grid; maximum error {max_error:.3f} units")
+    return fontbuilder, python_description
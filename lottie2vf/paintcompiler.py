@@ -6,8 +6,11 @@ from fontTools.varLib.builder import buildDeltaSetIndexMap
 from fontTools.feaLib.variableScalar import VariableScalar
 from fontTools.misc.fixedTools import floatToFixed, fixedToFloat
 from fontTools.ttLib.tables._f_v_a_r import Axis
+import copy
 import re
 
+from .bounds import clip_boxes
+
 
 def compile_color(c):
     return tuple(int(x, 16) / 255 for x in [c[1:3], c[3:5], c[5:7], c[7:9]])
@@ -18,21 +21,26 @@ def compile_colors(colors):
 
 
 class PythonBuilder:
-    def __init__(self, font) -> None:
+    def __init__(self, font, glyph_aliases=None) -> None:
         self.font = font
+        self.glyph_aliases = glyph_aliases or {}
         self.palette = []
         self.variations = []
         self.deltaset = []
+        # Glyphs whose paint is defined inline by PaintColrGlyph
+        self.colr_glyphs = {}
         assert "fvar" in font, "Font needs an fvar table"
         self.axes = font["fvar"].axes
         axis_tags = [x.axisTag for x in self.axes]
         self.varstorebuilder = OnlineVarStoreBuilder(axis_tags)
 
-    def string_to_var_scalar(self, s, f2dot14=False, converter=None):
+    def string_to_var_scalar(self, s, f2dot14=False, converter=None, fixed=False):
         if converter is None:
             converter = lambda x: float(x)
             if f2dot14:
                 converter = lambda x: floatToFixed(float(x), 14)
+            if fixed:
+                converter = lambda x: floatToFixed(float(x), 16)
         v = VariableScalar()
         v.axes = self.axes
         default_location = {axis.axisTag: axis.defaultValue for axis in self.axes}
@@ -44,7 +52,8 @@ class PythonBuilder:
 
         for values in s.split():
             locations, value = values.split(":")
-            if converter(value) <= -32768 or converter(value) >= 32768:
+            # 16.16 values have 32-bit deltas
+            if not fixed and (converter(value) <= -32768 or converter(value) >= 32768):
                 raise ValueError(f"Value too big in '{s}'")
             location = {}
             for loc in locations.split(","):
@@ -113,8 +122,15 @@ class PythonBuilder:
         }
 
     def PaintGlyph(self, glyph, paint=None):
+        glyph = self.glyph_aliases.get(glyph, glyph)
         return {"Format": 10, "Glyph": glyph, "Paint": paint}
 
+    def PaintColrGlyph(self, glyph, paint=None):
+        # The first reference to a glyph may also give its paint
+        if paint is not None:
+            self.colr_glyphs[glyph] = paint
+        return {"Format": 11, "Glyph": glyph}
+
     def PaintTransform(self, matrix, paint):
         return {
             "Format": 12,
@@ -129,6 +145,22 @@ class PythonBuilder:
             },
         }
 
+    def PaintVarTransform(self, matrix, paint):
+        base = len(self.deltaset)
+        transform = {}
+        for key, value in zip(("xx", "xy", "yx", "yy", "dx", "dy"), matrix):
+            vs = self.string_to_var_scalar(value, fixed=True)
+            default, index = vs.add_to_variation_store(self.varstorebuilder)
+            self.deltaset.append(index)
+            transform[key] = fixedToFloat(default, 16)
+        # VarAffine2x3 stores its variation indices in xx, yx, xy, yy order
+        self.deltaset[base + 1], self.deltaset[base + 2] = (
+            self.deltaset[base + 2],
+            self.deltaset[base + 1],
+        )
+        transform["VarIndexBase"] = base
+        return {"Format": 13, "Paint": paint, "Transform": transform}
+
     def PaintTranslate(self, dx, dy, paint):
         return {"Format": 14, "dx": dx, "dy": dy, "Paint": paint}
 
@@ -329,7 +361,41 @@ class PythonBuilder:
         t_palette = list(map(list, zip(*palette)))
         self.font["CPAL"] = buildCPAL(t_palette)
 
-    def build_colr(self, glyphs):
+    def clip_box(self, box):
+        # Either a static (xMin, yMin, xMax, yMax) or a list of
+        # (normalized location, box) masters for a variable one
+        if isinstance(box, tuple):
+            return box
+        axis = self.axes[0]
+        to_user = lambda loc: axis.defaultValue + loc * (axis.maxValue - axis.defaultValue)
+        base = len(self.deltaset)
+        defaults = []
+        for ix in range(4):
+            value = " ".join(
+                f"{axis.axisTag}={to_user(location)}:{master[ix]}" for location, master in box
+            )
+            vs = self.string_to_var_scalar(value)
+            default, index = vs.add_to_variation_store(self.varstorebuilder)
+            self.deltaset.append(index)
+            defaults.append(default)
+        return (*defaults, base)
+
+    def build_colr(self, glyphs, clips=False):
+        glyphs = {**self.colr_glyphs, **glyphs}
+        clip_list = {}
+        if clips:
+            # Measure the paints in a provisional table, then add the clip
+            # boxes' own variations before the store is finished for real.
+            provisional = buildCOLR(
+                glyphs,
+                varStore=copy.deepcopy(self.varstorebuilder).finish(),
+                varIndexMap=buildDeltaSetIndexMap(self.deltaset),
+                version=1,
+            )
+            clip_list = {
+                glyph: self.clip_box(box)
+                for glyph, box in clip_boxes(self.font, provisional.table).items()
+            }
         store = self.varstorebuilder.finish()
         mapping = store.optimize()
         self.deltaset = [mapping[v] for v in self.deltaset]
@@ -338,11 +404,17 @@ class PythonBuilder:
             varStore=store,
             varIndexMap=buildDeltaSetIndexMap(self.deltaset),
             version=1,
+            clipBoxes=clip_list,
         )
 
 
-def compile_paints(font, python_code):
-    builder = PythonBuilder(font)
+def compile_paints(font, python_code, glyph_aliases=None, clips=False):
+    """Runs a paint description and builds the COLR and CPAL tables from it.
+
+    If `clips` is true, each base glyph gets a clip box around everything
+    it draws over the whole animation (see `bounds.clip_boxes`); the font's
+    glyphs must have been added already."""
+    builder = PythonBuilder(font, glyph_aliases)
     methods = [
         x for x in dir(builder) if x.startswith("Paint") or x.startswith("ColorLine")
     ]
@@ -351,5 +423,5 @@ def compile_paints(font, python_code):
         this_locals[method] = getattr(builder, method)
     exec(python_code, this_locals, this_locals)
 
-    builder.build_colr(this_locals["glyphs"])
+    builder.build_colr(this_locals["glyphs"], clips)
     builder.build_palette()
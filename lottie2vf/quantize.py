@@ -0,0 +1,83 @@
+import math
+import numpy as np
+from contextlib import contextmanager
+
+
+__all__ = ["Quantizer"]
+
+
+class Quantizer:
+    """Snaps coordinates and transform values to a grid.
+
+    Coordinates and translations are rounded to multiples of `grid` font
+    units. Scale factors and rotation angles are rounded to the step which
+    moves a point at the edge of the canvas by at most `grid` units, so all
+    values are quantized to roughly the same visual precision. Snapped values
+    are much more likely to repeat, which gives more identical deltas for
+    gvar and the VarStore to share.
+
+    Values may be scalars or NumPy arrays. With a `grid` of None, values
+    are passed through unchanged.
+
+    The largest displacement on the canvas introduced so far is kept in
+    `max_error`. A value's snap is magnified by the scaling of the
+    transforms it ends up under, which callers declare with `magnified`
+    while they snap it. Snaps of several values along one paint chain can
+    still add up, so this is the worst single snap, not a bound on their
+    sum.
+    """
+
+    def __init__(self, grid, animation):
+        self.grid = grid
+        self.max_error = 0
+        self.magnification = 1
+        if grid:
+            self.scale_step = grid / max(animation.width, animation.height)
+            self.angle_step = math.degrees(grid / math.hypot(animation.width, animation.height))
+
+    def _snap(self, value, step):
+        return np.round(np.round(np.asarray(value) / step) * step, 10)
+
+    @contextmanager
+    def magnified(self, factor):
+        """Values snapped within this block are drawn scaled up by `factor`
+        (on top of any enclosing block's factor)."""
+        previous = self.magnification
+        self.magnification = previous * factor
+        try:
+            yield
+        finally:
+            self.magnification = previous
+
+    def _record(self, error):
+        if np.size(error):
+            error = float(np.max(error)) * self.magnification
+            self.max_error = max(self.max_error, error)
+
+    def coord(self, value):
+        if not self.grid:
+            return value
+        snapped = self._snap(value, self.grid)
+        self._record(np.abs(snapped - value))
+        return snapped
+
+    def point(self, x, y):
+        if not self.grid:
+            return x, y
+        snapped = self._snap(x, self.grid), self._snap(y, self.grid)
+        self._record(math.hypot(snapped[0] - x, snapped[1] - y))
+        return snapped
+
+    def scale(self, value):
+        if not self.grid:
+            return value
+        snapped = self._snap(value, self.scale_step)
+        self._record(np.abs(snapped - value) * self.grid / self.scale_step)
+        return snapped
+
+    def angle(self, value):
+        if not self.grid:
+            return value
+        snapped = self._snap(value, self.angle_step)
+        self._record(np.abs(snapped - value) * self.grid / self.angle_step)
+        return snapped
@@ -0,0 +1,162 @@
+import logging
+import numpy as np
+from lottie import objects
+
+from .transformation import values_to_ot
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["repeater_copies", "copies_magnification", "copy_to_paint"]
+
+
+def _repeater_properties(repeater):
+    tr = repeater.transform
+    return (
+        repeater.copies,
+        repeater.offset,
+        tr.position,
+        tr.anchor_point,
+        tr.scale,
+        tr.rotation,
+        tr.start_opacity,
+        tr.end_opacity,
+    )
+
+
+def _sample(prop, frames, keyframes, default):
+    if prop is None:
+        value = default
+    elif prop in keyframes:
+        return keyframes[prop].sample(frames)
+    else:
+        value = prop.get_value(0)
+        if value is None:
+            value = default
+    components = value.components if hasattr(value, "components") else [value]
+    return np.tile(np.asarray(components[: np.size(default)], dtype=float), (len(frames), 1))
+
+
+def repeater_copies(repeater, keyframes, timeline):
+    """Works out where each copy made by a Repeater goes, and how opaque it is.
+
+    As in lottie-web, copy ``k`` has the repeater's transform applied
+    ``k + offset`` times: positions and rotations add up, scales multiply,
+    and a fractional step scales by the same fraction of the way. Copies
+    fade from the start opacity to the end opacity.
+
+    Returns the snapped times at which the copies are sampled (just one time
+    if nothing about the repeater is animated) and a list of copies in
+    painting order, bottom first. Each copy is a dictionary of arrays with one
+    row per time: "translate", "angle", "scale", "anchor" and "alpha"."""
+    times = sorted(
+        {
+            timeline.snap(t)
+            for prop in _repeater_properties(repeater)
+            if prop is not None and prop in keyframes
+            for t in keyframes[prop].times.tolist()
+        }
+    ) or [0]
+    frames = [timeline.from_axis(t) for t in times]
+
+    tr = repeater.transform
+    copies = np.round(_sample(repeater.copies, frames, keyframes, 1)[:, 0])
+    offset = _sample(repeater.offset, frames, keyframes, 0)[:, 0]
+    position = _sample(tr.position, frames, keyframes, [0, 0])
+    anchor = _sample(tr.anchor_point, frames, keyframes, [0, 0])
+    scale = _sample(tr.scale, frames, keyframes, [100, 100]) / 100
+    rotation = _sample(tr.rotation, frames, keyframes, 0)[:, 0]
+    start_opacity = _sample(tr.start_opacity, frames, keyframes, 100)[:, 0] / 100
+    end_opacity = _sample(tr.end_opacity, frames, keyframes, 100)[:, 0] / 100
+
+    # Animated copy counts are handled by fading out the copies which are
+    # not there yet, so there are as many copies as there ever are.
+    count = int(copies.max(initial=0))
+    result = []
+    for k in range(count):
+        steps = k + offset
+        whole = np.floor(steps)[:, None]
+        fraction = steps[:, None] - whole
+        fade = np.where(copies > 1, k / np.maximum(copies - 1, 1), 0)
+        alpha = start_opacity + (end_opacity - start_opacity) * fade
+        result.append(
+            {
+                "translate": position * steps[:, None],
+                "angle": rotation * steps,
+                "scale": scale ** whole * (1 + (scale - 1) * fraction),
+                "anchor": anchor,
+                "alpha": np.where(k < copies, alpha, 0),
+            }
+        )
+    if repeater.composite == objects.Composite.Below:
+        result.reverse()
+    return times, result
+
+
+def copies_magnification(copies):
+    """The most that any of the copies scales up what it repeats."""
+    return max((float(np.max(np.abs(copy["scale"]))) for copy in copies), default=1)
+
+
+def _varies(values):
+    return bool(np.any(values != values[0]))
+
+
+def _fit_angles(angles):
+    # Variable angles are stored as F2Dot14 half-turns, so must stay within
+    # ±360°; shift them by whole turns to sit around zero.
+    angles = angles - 360 * np.round((angles.max() + angles.min()) / 720)
+    if angles.max() >= 360 or angles.min() < -360:
+        logger.warn("Repeater rotates by more than two turns; clipping")
+        angles = np.clip(angles, -360, 359.9)
+    return angles
+
+
+def copy_to_paint(times, copy, paint, quantizer):
+    """Places `paint` where one of the copies from `repeater_copies` goes."""
+    anchor = copy["anchor"]
+    translate = copy["translate"] + anchor
+    angle = copy["angle"]
+    scale = copy["scale"]
+    alpha = copy["alpha"]
+
+    if not any(_varies(v) for v in (translate, angle, scale, anchor)):
+        # One static matrix: translate, rotate and scale about the anchor
+        radians = np.radians(angle[0])
+        cos, sin = np.cos(radians), np.sin(radians)
+        sx, sy = scale[0]
+        linear = np.array([[cos * sx, -sin * sy], [sin * sx, cos * sy]])
+        dx, dy = translate[0] - linear @ anchor[0]
+        if not np.allclose(linear, np.identity(2)) or not np.allclose((dx, dy), 0):
+            xx, xy, yx, yy = quantizer.scale(linear.flatten()).tolist()
+            dx, dy = quantizer.point(dx, dy)
+            paint = f"PaintTransform( ({xx}, {xy}, {yx}, {yy}, {dx}, {dy}), {paint})"
+    else:
+        with quantizer.magnified(float(np.max(np.abs(scale)))):
+            paint = _translate(times, -anchor, paint, quantizer)
+        if _varies(scale) or np.any(scale[0] != 1):
+            sx, sy = values_to_ot(times, quantizer.scale(scale))
+            paint = f"PaintVarTransform( ({sx}, 0, 0, {sy}, 0, 0), {paint})"
+        if _varies(angle):
+            angle = values_to_ot(times, quantizer.angle(_fit_angles(angle))[:, None])[0]
+            paint = f"PaintVarRotateAroundCenter( {angle}, (0,0), {paint})"
+        elif angle[0] % 360:
+            paint = f"PaintRotateAroundCenter( {quantizer.angle(angle[0] % 360)}, (0,0), {paint})"
+        paint = _translate(times, translate, paint, quantizer)
+
+    if _varies(alpha):
+        alpha = values_to_ot(times, alpha[:, None])[0]
+        paint = f"PaintComposite( 'dest_in', PaintVarSolid( '#000000FF', {alpha} ), {paint})"
+    elif alpha[0] != 1:
+        paint = f"PaintComposite( 'dest_in', PaintSolid( '#000000FF', alpha={alpha[0]} ), {paint})"
+    return paint
+
+
+def _translate(times, offsets, paint, quantizer):
+    if _varies(offsets):
+        dx, dy = values_to_ot(times, quantizer.coord(offsets))
+        return f"PaintVarTranslate( {dx}, {dy}, {paint})"
+    if np.any(offsets[0] != 0):
+        dx, dy = quantizer.point(*offsets[0].tolist())
+        return f"PaintTranslate( {dx}, {dy}, {paint})"
+    return paint
@@ -0,0 +1,140 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from .lottieparser import LottieParser, load_animation, glyph_name
+from .paintcompiler import compile_paints
+from .font import font_builder, add_glyphs, compile_glyph
+from .keyframes import KeyframeStore
+from .encoding import print_report
+from .timeline import Timeline, DEFAULT_EPSILON
+
+__all__ = ["convert_sharded"]
+
+# Glyph names are the only double-quoted strings in a paint description
+_GLYPH_REFERENCE = re.compile(r'"(glyph\d+)"')
+
+# Per-process state, set up once by _init_worker
+_worker = {}
+
+
+class ShardParser(LottieParser):
+    """A LottieParser which converts just one of the top-level layers."""
+
+    def __init__(self, animation, position, **kwargs):
+        super().__init__(animation, **kwargs)
+        self.position = position
+
+    def restructure_animation(self, animation, merge_paths):
+        restructured = super().restructure_animation(animation, merge_paths)
+        restructured.layers = [restructured.layers[self.position]]
+        return restructured
+
+
+def _init_worker(path, index, epsilon, grid, choose_encoding, an=None):
+    # Workers load the file themselves: lottie's objects can't be pickled,
+    # and a to_dict() round trip does not reproduce them exactly.
+    if an is None:
+        an = load_animation(path, index)
+    keyframes = KeyframeStore(an)
+    _worker.update(
+        animation=an,
+        epsilon=epsilon,
+        grid=grid,
+        choose_encoding=choose_encoding,
+        timeline=Timeline(an, epsilon, [keyframes]),
+        keyframes=keyframes,
+        fontbuilder=font_builder(an),
+    )
+
+
+def _convert_layer(position):
+    paint_builder = ShardParser(
+        _worker["animation"],
+        position,
+        epsilon=_worker["epsilon"],
+        timeline=_worker["timeline"],
+        grid=_worker["grid"],
+        keyframes=_worker["keyframes"],
+        choose_encoding=_worker["choose_encoding"],
+    )
+    paint_builder.process()
+    compiled = {
+        name: compile_glyph(name, glyph, _worker["fontbuilder"], paint_builder.quantizer)
+        for name, glyph in paint_builder.glyphs.items()
+    }
+    report = paint_builder.encodings.choices if paint_builder.encodings else {}
+    return (
+        paint_builder.result["paints"],
+        compiled,
+        paint_builder.quantizer.max_error,
+        report,
+    )
+
+
+def convert_sharded(
+    path,
+    an,
+    index=0,
+    epsilon=DEFAULT_EPSILON,
+    iup_tolerance=None,
+    jobs=None,
+    grid=None,
+    codepoint=0x61,
+    choose_encoding=False,
+    clip_boxes=False,
+):
+    """Converts one animation, spreading its top-level layers across `jobs`
+    worker processes (one per CPU by default).
+
+    `an` is the animation, already loaded from `path`; `index` says which
+    one it is in a dotLottie archive, for the workers to load. Each worker
+    parses a layer and compiles its glyphs; the results are then merged in
+    layer order, with the glyphs renumbered as a serial conversion would
+    have numbered them, so the font is identical to a serial build.
+
+    Returns the font builder and the paint description."""
+    layer_count = sum(1 for layer in an.layers if layer.parent_index is None)
+    initargs = (path, index, epsilon, grid, choose_encoding)
+    if jobs == 1:
+        _init_worker(*initargs, an)
+        results = list(map(_convert_layer, range(layer_count)))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=initargs
+        ) as executor:
+            results = list(executor.map(_convert_layer, range(layer_count)))
+
+    paints = []
+    compiled = {}
+    max_error = 0
+    report = {}
+    for layer_paints, layer_glyphs, error, layer_report in results:
+        names = {}
+        for name, entry in layer_glyphs.items():
+            names[name] = glyph_name(len(compiled))
+            compiled[names[name]] = entry
+        rename = lambda match: '"%s"' % names[match.group(1)]
+        paints.extend(_GLYPH_REFERENCE.sub(rename, paint) for paint in layer_paints)
+        max_error = max(max_error, error)
+        report.update((names[name], choice) for name, choice in layer_report.items())
+
+    paint_builder = LottieParser(an, epsilon=epsilon, grid=grid)
+    paint_builder.result = {"layer_transform": None, "paints": paints, "glyphs": {}}
+    python_description = 'glyphs["baseglyph"] = ' + paint_builder.paint
+
+    fontbuilder = font_builder(an)
+    add_glyphs(
+        fontbuilder,
+        {name: None for name in compiled},
+        iup_tolerance=iup_tolerance,
+        jobs=jobs,
+        base_glyphs={"baseglyph": codepoint},
+        compiled=compiled,
+    )
+    compile_paints(fontbuilder.font, python_description, clips=clip_boxes)
+
+    if grid:
+        print(f"Quantized to a {grid} unit grid; maximum error {max_error:.3f} units")
+    if choose_encoding:
+        print_report(report)
+    return fontbuilder, python_description
@@ -0,0 +1,111 @@
+import bisect
+import copy
+import logging
+from .keyframes import KeyframeStore
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["Timeline"]
+
+# Keyframe times closer together than this (in frames) share a region.
+DEFAULT_EPSILON = 0.01
+
+
+class Timeline:
+    """A global index of keyframe times across the whole animation.
+
+    Every animated property in the animation is visited once, its keyframe
+    times are clamped to the animation's frame range, and times within
+    ``epsilon`` of each other are snapped to a single canonical time. Both
+    the COLR variable scalars and the gvar tuples look their times up here,
+    so that they all share one minimal set of variation regions.
+
+    Several animations can share one timeline. Their frame ranges are then
+    stretched onto a common ``ANIM`` axis as long as the longest of them, and
+    `for_animation` returns the view which a given animation's times should
+    be snapped through.
+
+    The keyframe times are taken from each animation's `KeyframeStore`;
+    pass the `stores` if they have already been built, so the animations
+    are not walked again.
+    """
+
+    def __init__(self, animations, epsilon=DEFAULT_EPSILON, stores=None):
+        if not isinstance(animations, (list, tuple)):
+            animations = [animations]
+        if stores is None:
+            stores = [KeyframeStore(an) for an in animations]
+        self.start = min(an.in_point for an in animations)
+        self.end = self.start + max(an.out_point - an.in_point for an in animations)
+        self.epsilon = epsilon
+        self.times = []
+        self._snapped = {}
+        self._offset = 0
+        self._scale = 1
+        self._build(animations, stores)
+        self._offset, self._scale = self._mapping(animations[0])
+
+    def _mapping(self, animation):
+        duration = animation.out_point - animation.in_point
+        scale = (self.end - self.start) / duration if duration else 1
+        return self.start - animation.in_point * scale, scale
+
+    def for_animation(self, animation):
+        """Returns a view of this timeline for one of its animations."""
+        view = copy.copy(self)
+        view._offset, view._scale = self._mapping(animation)
+        return view
+
+    def to_axis(self, time):
+        """Maps a frame of the current animation onto the ANIM axis."""
+        if self._scale == 1:
+            return time + self._offset
+        return time * self._scale + self._offset
+
+    def from_axis(self, location):
+        """Maps a location on the ANIM axis back to a frame of the animation."""
+        if self._scale == 1:
+            return location - self._offset
+        return (location - self._offset) / self._scale
+
+    def _build(self, animations, stores):
+        raw = set()
+        for animation, store in zip(animations, stores):
+            self._offset, self._scale = self._mapping(animation)
+            raw.update(self.to_axis(store.times).tolist())
+
+        for time in sorted(raw):
+            clamped = self.clamp(time)
+            if self.times and clamped - self.times[-1] <= self.epsilon:
+                self._snapped[time] = self.times[-1]
+                continue
+            self.times.append(clamped)
+            self._snapped[time] = clamped
+
+        logger.debug(
+            "%i distinct keyframe times snapped to %i regions",
+            len(raw),
+            len(self.times),
+        )
+
+    def clamp(self, time):
+        return min(max(time, self.start), self.end)
+
+    def snap(self, time):
+        """Returns the canonical axis location for a keyframe time."""
+        time = self.to_axis(time)
+        if time in self._snapped:
+            return self._snapped[time]
+        clamped = self.clamp(time)
+        ix = bisect.bisect_left(self.times, clamped)
+        for candidate in self.times[max(ix - 1, 0) : ix + 1]:
+            if abs(candidate - clamped) <= self.epsilon:
+                return candidate
+        return clamped
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return iter(self.times)
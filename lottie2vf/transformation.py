@@ -1,42 +1,72 @@
 import logging
 import math
+import numpy as np
 from lottie.utils.transform import TransformMatrix
 
 
 logger = logging.getLogger(__name__)
 
 
-def animated_value_to_ot(keyframes, animation):
-    values = [""] * len(keyframes[0].start.components)
-    for ix in range(len(values)):
-        if all(
-            [
-                keyframes[0].start.components[ix] == k.start.components[ix]
-                for k in keyframes
-                if k.start
-            ]
-        ):
+def animated_value_to_ot(columns, timeline, convert=None):
+    """Turns an animated property's columns (see `keyframes.PropertyColumns`)
+    into one value per component, either a constant or a string of
+    ``ANIM=time:value`` pairs. `convert`, if given, is applied to the whole
+    array of values at once."""
+    raw = columns.times.tolist()
+    times = [timeline.snap(t) for t in raw]
+    values = columns.values
+    # Keyframes which were clamped to the frame range or merged into a
+    # nearby time take the property's value at the time they were snapped
+    # to, which is where the glyph outlines are sampled too.
+    moved = [ix for ix, t in enumerate(raw) if times[ix] != timeline.to_axis(t)]
+    if moved:
+        values = values.copy()
+        values[moved] = columns.sample([timeline.from_axis(times[ix]) for ix in moved])
+    if convert is not None:
+        values = convert(values)
+    return values_to_ot(times, values)
+
+
+def values_to_ot(times, values):
+    """Like `animated_value_to_ot`, for an array of values (one row per
+    snapped time) which is not a Lottie property."""
+    # Most properties have a handful of keyframes, for which going through
+    # Python lists is quicker than NumPy
+    result = []
+    for column in np.asarray(values).T.tolist():
+        if all(v == column[0] for v in column):
             # This isn't animated
-            values[ix] = keyframes[0].start.components[ix]
-        else:
-            seen = set()
-            for k in keyframes:
-                if not k.start:
-                    continue
-                v = k.start.components[ix]
-                if k.time < 0:
-                    k.time = 0
-                if k.time > animation.out_point:
-                    k.time = animation.out_point
-                if k.time in seen:
-                    continue
-                seen.add(k.time)
-                values[ix] += f"ANIM={k.time}:{v} "
-            values[ix] = f'"{values[ix]}"'
-    return values
-
-
-def scale_to_paint(transform, paint, animation):
+            result.append(column[0])
+            continue
+        seen = set()
+        value = ""
+        for time, v in zip(times, column):
+            if time in seen:
+                continue
+            seen.add(time)
+            value += f"ANIM={time}:{v} "
+        result.append(f'"{value}"')
+    return result
+
+
+def _scale_value(v, scale, keyframes):
+    v = v / 100
+    oversized = np.asarray(v) >= 2
+    if np.any(oversized):
+        # A layer's transform is painted once per group, so only say it once
+        if keyframes.first_warning(scale):
+            where = ""
+            if oversized.ndim == 2:
+                where = f" in {np.count_nonzero(oversized.any(axis=1))} of {len(v)} keyframes"
+            logger.warn(
+                f"Oversized scale {np.max(v):g} found{where}; clipping to 2; "
+                "need to implement PaintVarTransform"
+            )
+        v = np.where(oversized, 1.99, v)
+    return v
+
+
+def scale_to_paint(transform, paint, keyframes, timeline, quantizer):
     scale = transform.scale
     if not scale:
         return paint
@@ -45,40 +75,15 @@ def scale_to_paint(transform, paint, animation):
     if not animated and all(x == 100 for x in scale.value.components):
         return paint
 
+    convert = lambda v: quantizer.scale(_scale_value(v, scale, keyframes))
     if not animated:
-        # Scale down the scale
-        scale = scale.clone()
-        scale.value /= 100
-        if scale.value.x > 2:
-            logger.warn(
-                f"Oversized scale {k.start} found; clipping to 2; need to implement PaintVarTransform"
-            )
-            scale.value.x = 1.99
-
-        return f"PaintScale( {scale.value.x}, {scale.value.y}, {paint})"
-
-    # Scale down the scale
-    scale = scale.clone()
-    for k in scale.keyframes:
-        if not k.start:
-            continue
-        k.start /= 100
-        if k.start.x >= 2:
-            logger.warn(
-                f"Oversized scale {k.start} found; clipping to 2; need to implement PaintVarTransform"
-            )
-            k.start.x = 1.99
-        if k.start.y >= 2:
-            logger.warn(
-                f"Oversized scale {k.start} found; clipping to 2; need to implement PaintVarTransform"
-            )
-            k.start.y = 1.99
+        return f"PaintScale( {convert(scale.value.x)}, {convert(scale.value.y)}, {paint})"
 
-    animated_scale = animated_value_to_ot(scale.keyframes, animation)
+    animated_scale = animated_value_to_ot(keyframes[scale], timeline, convert)
     return f"PaintVarScale( {animated_scale[0]}, {animated_scale[1]}, {paint})"
 
 
-def rotation_to_paint(transform, paint, animation):
+def rotation_to_paint(transform, paint, keyframes, timeline, quantizer):
     rotation = transform.rotation
     anchor = transform.anchor_point
     has_anchor = anchor and (
@@ -91,15 +96,14 @@ def rotation_to_paint(transform, paint, animation):
         return paint
 
     if animated:
-        rotation = rotation.clone()
-        animated_rotation = animated_value_to_ot(rotation.keyframes, animation)
+        animated_rotation = animated_value_to_ot(keyframes[rotation], timeline, quantizer.angle)
         return f"PaintVarRotateAroundCenter( {animated_rotation[0]}, (0,0), {paint})"
 
-    angle = rotation.value
+    angle = quantizer.angle(rotation.value)
     return f"PaintRotateAroundCenter( {angle}, (0,0), {paint})"
 
 
-def position_to_paint(transform, paint, animation):
+def position_to_paint(transform, paint, keyframes, timeline, quantizer):
     position = transform.position
     animated = position.animated
 
@@ -107,13 +111,14 @@ def position_to_paint(transform, paint, animation):
         return paint
 
     if not animated:
-        return f"PaintTranslate( {position.value.x}, {position.value.y}, {paint})"
+        x, y = quantizer.point(position.value.x, position.value.y)
+        return f"PaintTranslate( {x}, {y}, {paint})"
 
-    animated_pos = animated_value_to_ot(position.keyframes, animation)
+    animated_pos = animated_value_to_ot(keyframes[position], timeline, quantizer.coord)
     return f"PaintVarTranslate( {animated_pos[0]}, {animated_pos[1]}, {paint})"
 
 
-def anchor_to_paint(transform, paint, animation):
+def anchor_to_paint(transform, paint, keyframes, timeline, quantizer):
     anchor = transform.anchor_point
     animated = anchor.animated
 
@@ -121,44 +126,61 @@ def anchor_to_paint(transform, paint, animation):
         return paint
 
     if not animated:
-        return f"PaintTranslate( {-anchor.value.x}, {-anchor.value.y}, {paint})"
+        x, y = quantizer.point(-anchor.value.x, -anchor.value.y)
+        return f"PaintTranslate( {x}, {y}, {paint})"
 
-    anchor = anchor.clone()
-    for k in anchor.keyframes:
-        k.start *= -1
-    animated_pos = animated_value_to_ot(anchor.keyframes, animation)
+    animated_pos = animated_value_to_ot(
+        keyframes[anchor], timeline, lambda v: quantizer.coord(-v)
+    )
     return f"PaintVarTranslate( {animated_pos[0]}, {animated_pos[1]}, {paint})"
 
-def matrix_to_paint(matrix, paint):
+def matrix_to_paint(matrix, paint, quantizer):
     if matrix.to_css_2d() == TransformMatrix().to_css_2d():
         return paint
+    tx, ty = quantizer.point(matrix.tx, matrix.ty)
     return f"""PaintTransform((
         {matrix.a}, { matrix.b }, {matrix.c}, {matrix.d},
-        {matrix.tx}, { matrix. ty}
+        {tx}, {ty}
     ), {paint} )"""
 
 
-def apply_transform_to_paint(transform, paint, animation):
-    frames = (
-        (transform.scale and transform.scale.keyframes or [])
-        + (transform.position.keyframes or [])
-        + (transform.rotation and transform.rotation.keyframes or [])
-    )
-    if not frames:
-        return matrix_to_paint(transform.to_matrix(0), paint)
-    matrices = {k.time: transform.to_matrix(k.time) for k in frames}
-
-    return position_to_paint(
-        transform,
-        rotation_to_paint(transform,
-            scale_to_paint(
-                transform,
-                    anchor_to_paint(
-                        transform, paint, animation
-                    ),
-                animation
-            ),
-            animation
-        ),
-        animation,
+def _is_animated(transform):
+    return any(
+        prop and prop.animated and prop.keyframes
+        for prop in (transform.scale, transform.position, transform.rotation)
     )
+
+
+def _scale_magnification(transform, keyframes):
+    scale = transform.scale
+    if not scale:
+        return 1
+    values = keyframes[scale].values.ravel().tolist() if scale.animated else scale.value.components
+    # Clipped as in _scale_value
+    return max(abs(1.99 if v >= 2 else v) for v in (x / 100 for x in values))
+
+
+def transform_magnification(transform, keyframes):
+    """The most that a transform, as `apply_transform_to_paint` paints it,
+    ever scales up what it is applied to."""
+    if not transform:
+        return 1
+    if not _is_animated(transform):
+        # The largest singular value of the matrix's linear part
+        m = keyframes.matrix(transform)
+        half = (m.a ** 2 + m.b ** 2 + m.c ** 2 + m.d ** 2) / 2
+        det = m.a * m.d - m.b * m.c
+        return math.sqrt(half + math.sqrt(max(half ** 2 - det ** 2, 0)))
+    return _scale_magnification(transform, keyframes)
+
+
+def apply_transform_to_paint(transform, paint, keyframes, timeline, quantizer):
+    if not _is_animated(transform):
+        return matrix_to_paint(keyframes.matrix(transform), paint, quantizer)
+
+    # The anchor point is moved under the scale
+    with quantizer.magnified(_scale_magnification(transform, keyframes)):
+        paint = anchor_to_paint(transform, paint, keyframes, timeline, quantizer)
+    paint = scale_to_paint(transform, paint, keyframes, timeline, quantizer)
+    paint = rotation_to_paint(transform, paint, keyframes, timeline, quantizer)
+    return position_to_paint(transform, paint, keyframes, timeline, quantizer)
@@ -0,0 +1,235 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from lottie import objects
+
+from .lottieparser import LottieParser
+from .paintcompiler import compile_paints
+from .font import font_builder, add_glyphs
+from .timeline import Timeline, DEFAULT_EPSILON
+from .keyframes import KeyframeStore, keyframe_times
+from .encoding import print_report
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["IncrementalBuilder", "watch"]
+
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+def _layer_lists(tree):
+    yield "layers", tree.get("layers", [])
+    for asset in tree.get("assets", []):
+        if "layers" in asset:
+            yield asset.get("id"), asset["layers"]
+
+
+def diff_animation(old, new):
+    """Compares two Lottie JSON trees.
+
+    Returns a set of ``(composition, position)`` pairs for the layers which
+    differ, where the composition is either "layers" for the main layer list
+    or the id of a precomp asset. Returns None if anything else (size, frame
+    range, the shape of the layer lists...) changed and everything needs to
+    be rebuilt."""
+    if old is None:
+        return None
+    strip = lambda tree: {
+        k: v for k, v in tree.items() if k not in ("layers", "assets")
+    }
+    if strip(old) != strip(new):
+        return None
+    old_lists = dict(_layer_lists(old))
+    new_lists = dict(_layer_lists(new))
+    if {k: len(v) for k, v in old_lists.items()} != {
+        k: len(v) for k, v in new_lists.items()
+    }:
+        return None
+    old_assets = [a for a in old.get("assets", []) if "layers" not in a]
+    new_assets = [a for a in new.get("assets", []) if "layers" not in a]
+    if old_assets != new_assets:
+        return None
+    return {
+        (comp, ix)
+        for comp, layers in new_lists.items()
+        for ix, (a, b) in enumerate(zip(old_lists[comp], layers))
+        if a != b
+    }
+
+
+class IncrementalParser(LottieParser):
+    """A LottieParser which reuses the paints and glyphs of layers which have
+    not changed since the previous build.
+
+    A layer's results are only reused if the layer, everything parented to
+    it and any precomp it references are unchanged, its keyframes still snap
+    to the same times on the timeline (which other layers' keyframes can
+    move), *and* its glyphs would be given the same names, i.e. no layer
+    processed before it gained or lost a glyph. Otherwise it is processed as usual, which may in turn reuse the
+    results of its own children."""
+
+    def __init__(self, animation, digests, layer_cache, **kwargs):
+        super().__init__(animation, **kwargs)
+        self._digests = digests
+        self._previous = layer_cache
+        self._keys = {}
+        self.layer_cache = {}
+        self.reused = 0
+        self.rebuilt = 0
+
+    def _layer_key(self, layer_builder):
+        if id(layer_builder) in self._keys:
+            return self._keys[id(layer_builder)]
+        lot = layer_builder.lottie
+        precomp = ()
+        if isinstance(lot, objects.PreCompLayer):
+            precomp = tuple(
+                self._layer_key(layer)
+                for layer in self._precomps.get(lot.reference_id, [])
+            )
+        key = (
+            self._digests[id(lot)],
+            tuple(self.timeline.snap(t) for t in sorted(keyframe_times(lot))),
+            tuple(
+                self._layer_key(c)
+                for c in layer_builder.children_pre + layer_builder.children_post
+            ),
+            precomp,
+        )
+        self._keys[id(layer_builder)] = key
+        return key
+
+    def process_layer(self, layer_builder, dom_parent):
+        key = (self._layer_key(layer_builder), len(self.result["glyphs"]))
+        if key in self._previous:
+            paints, glyphs = self._previous[key]
+            self.result["paints"].extend(paints)
+            self.result["glyphs"].update(glyphs)
+            self.reused += 1
+        else:
+            first_paint = len(self.result["paints"])
+            first_glyph = len(self.result["glyphs"])
+            super().process_layer(layer_builder, dom_parent)
+            paints = self.result["paints"][first_paint:]
+            glyphs = dict(list(self.result["glyphs"].items())[first_glyph:])
+            self.rebuilt += 1
+        self.layer_cache[key] = (paints, glyphs)
+
+
+class IncrementalBuilder:
+    """Keeps the parsed animation, its glyphs and its paints in memory so
+    that a changed Lottie file can be turned into a new font by redoing only
+    the layers which changed."""
+
+    def __init__(
+        self,
+        infile,
+        output,
+        epsilon=DEFAULT_EPSILON,
+        iup_tolerance=None,
+        jobs=None,
+        grid=None,
+        choose_encoding=False,
+        clip_boxes=False,
+    ):
+        self.infile = infile
+        self.output = output
+        self.epsilon = epsilon
+        self.grid = grid
+        self.choose_encoding = choose_encoding
+        self.clip_boxes = clip_boxes
+        self.iup_tolerance = iup_tolerance
+        self.jobs = jobs
+        self.tree = None
+        self.layer_cache = {}
+        self.glyph_cache = {}
+
+    def build(self):
+        start = time.time()
+        with open(self.infile) as f:
+            tree = json.load(f)
+
+        changed = diff_animation(self.tree, tree)
+        if changed is None:
+            self.layer_cache = {}
+            self.glyph_cache = {}
+        elif not changed:
+            return
+        else:
+            logger.info("Layers changed: %s", sorted(changed))
+
+        an = objects.Animation.load(copy.deepcopy(tree))
+        digests = {}
+        lottie_lists = [an.layers] + [
+            asset.layers for asset in an.assets or [] if isinstance(asset, objects.Precomp)
+        ]
+        for (_, layers), lottie_layers in zip(_layer_lists(tree), lottie_lists):
+            for layer, lottie_layer in zip(layers, lottie_layers):
+                digests[id(lottie_layer)] = _digest(layer)
+
+        keyframes = KeyframeStore(an)
+        timeline = Timeline(an, self.epsilon, [keyframes])
+        paint_builder = IncrementalParser(
+            an,
+            digests,
+            self.layer_cache,
+            epsilon=self.epsilon,
+            timeline=timeline,
+            keyframes=keyframes,
+            grid=self.grid,
+            choose_encoding=self.choose_encoding,
+        )
+        paint_builder.process()
+        if paint_builder.encodings:
+            print_report(paint_builder.encodings.choices)
+        self.layer_cache = paint_builder.layer_cache
+
+        fontbuilder = font_builder(an)
+        add_glyphs(
+            fontbuilder,
+            paint_builder.glyphs,
+            iup_tolerance=self.iup_tolerance,
+            jobs=self.jobs,
+            cache=self.glyph_cache,
+            quantizer=paint_builder.quantizer,
+        )
+        compile_paints(
+            fontbuilder.font,
+            'glyphs["baseglyph"] = ' + paint_builder.paint,
+            clips=self.clip_boxes,
+        )
+        fontbuilder.font.save(self.output)
+        self.tree = tree
+        print(
+            f"Rebuilt {paint_builder.rebuilt} layers, "
+            f"reused {paint_builder.reused}; "
+            f"written on {self.output} in {time.time() - start:.2f}s"
+        )
+
+
+def watch(infile, output, interval=0.25, **kwargs):
+    """Rebuilds `output` whenever `infile` changes, until interrupted."""
+    builder = IncrementalBuilder(infile, output, **kwargs)
+    mtime = None
+    print(f"Watching {infile}; press Ctrl-C to stop")
+    try:
+        while True:
+            try:
+                new_mtime = os.stat(infile).st_mtime
+            except FileNotFoundError:
+                new_mtime = None
+            if new_mtime is not None and new_mtime != mtime:
+                mtime = new_mtime
+                try:
+                    builder.build()
+                except Exception as e:
+                    # Keep watching; the file may be half-written or broken
+                    logger.error(f"Could not build {infile}: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass